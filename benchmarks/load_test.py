@@ -0,0 +1,390 @@
+"""
+End-to-end load test of a Flask app using Flask-Shoppingcart.
+
+It starts a local multi-process server for every storage backend and cart cookie mode, and drives it with many
+simulated clients, each with its own cookies, running a mix of requests per scenario. For every scenario, backend
+and cookie mode it reports the latency percentiles, the throughput and the size of the cookies sent and received.
+
+The server is pre-forked, like a production server: a fixed number of long-lived worker processes, each serving
+the connections with threads, accept from a shared socket. The backends that keep their state in the worker process
+(in-memory reservations, in-memory storage with striped locks) are only correct in a single process, so they run
+with one worker. The cart locks are only used with a server-side storage, as they protect nothing without one.
+
+Usage (from the root of the repository):
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --scenarios browse checkout --backends cookie sqlite-reservations --clients 32 --duration 20
+    python benchmarks/load_test.py --cookie-modes summary off
+    python benchmarks/load_test.py --json results.json
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.cookies import SimpleCookie
+from typing import Callable, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PRODUCTS = 1000
+STOCK = 1_000_000
+
+BACKENDS = ["cookie", "memory-reservations", "sqlite-reservations", "memory-storage", "sqlite-storage", "sharded-storage"]
+
+#: Backends whose state lives in the worker process, so they are run with a single worker.
+IN_PROCESS_BACKENDS = {"memory-reservations", "memory-storage"}
+
+COOKIE_MODES = ["full", "summary", "off"]
+
+
+def create_app(backend: str, cookie_mode: str, data_dir: str):
+	"""
+	The example JSON API, with an unrelated product page and a checkout route, configured for a storage backend
+	and a cart cookie mode.
+	"""
+	from flask import Flask, jsonify
+
+	from src.flask_shoppingcart import (FileCartLock, FlaskShoppingCart,
+	                                    MemoryCartStore,
+	                                    MemoryReservationLedger,
+	                                    ShardedCartStore, SQLiteCartStore,
+	                                    SQLiteReservationLedger,
+	                                    StripedCartLock, create_cart_blueprint)
+
+	app = Flask(__name__)
+	app.config['SECRET_KEY'] = 'load-test'
+	app.config['FLASK_SHOPPING_CART_COOKIE_MODE'] = cookie_mode
+
+	options: dict = {
+		"cookie": {},
+		"memory-reservations": {"reservations": MemoryReservationLedger()},
+		"sqlite-reservations": {"reservations": SQLiteReservationLedger(os.path.join(data_dir, "reservations.db"))},
+		"memory-storage": {"storage": MemoryCartStore(), "lock": StripedCartLock()},
+		"sqlite-storage": {
+			"storage": SQLiteCartStore(os.path.join(data_dir, "carts.db")),
+			"lock": FileCartLock(os.path.join(data_dir, "locks")),
+		},
+		"sharded-storage": {
+			"storage": ShardedCartStore({f"shard-{i}": SQLiteCartStore(os.path.join(data_dir, f"carts-{i}.db")) for i in range(4)}),
+			"lock": FileCartLock(os.path.join(data_dir, "locks")),
+		},
+	}[backend]
+
+	shopping_cart = FlaskShoppingCart(app, **options)
+	stock = {str(i): STOCK for i in range(PRODUCTS)}
+	app.register_blueprint(create_cart_blueprint(shopping_cart, url_prefix='/api', get_stock=stock.get))
+
+	@app.route('/products/<product_id>')
+	def view_product(product_id: str):
+		return jsonify({'id': product_id, 'stock': shopping_cart.get_available_stock(product_id, stock.get(product_id, 0))})
+
+	@app.route('/checkout', methods=['POST'])
+	def checkout():
+		order = shopping_cart.get_cart()
+		shopping_cart.clear()
+		return jsonify({'lines': len(order)})
+
+	return app
+
+
+def serve_worker(backend: str, cookie_mode: str, fd: int, data_dir: str) -> None:
+	from werkzeug.serving import make_server
+
+	# Each worker builds its own app, so the SQLite connections and lock files are not shared with the parent
+	make_server("127.0.0.1", 0, create_app(backend, cookie_mode, data_dir), threaded=True, fd=fd).serve_forever()
+
+
+def serve(backend: str, cookie_mode: str, port: int, workers: int, data_dir: str) -> None:
+	"""
+	Serve the app with `workers` long-lived processes accepting from a shared socket, each with a thread per connection.
+	"""
+	listener = socket.socket()
+	listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	listener.bind(("127.0.0.1", port))
+	listener.listen(1024)
+
+	context = multiprocessing.get_context("fork")
+	processes = [
+		context.Process(target=serve_worker, args=(backend, cookie_mode, listener.fileno(), data_dir), daemon=True)
+		for _ in range(workers)
+	]
+
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+	try:
+		for process in processes:
+			process.start()
+
+		for process in processes:
+			process.join()
+
+	finally:
+		for process in processes:
+			process.terminate()
+
+
+class Client:
+	"""
+	A simulated user: a keep-alive connection and a cookie jar.
+	"""
+
+	def __init__(self, port: int, record: Callable[[float, int, int, int], None]) -> None:
+		self.port = port
+		self.record = record
+		self.cookies: dict[str, str] = {}
+		self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+
+	def _send(self, method: str, url: str, data: Optional[str], headers: dict) -> http.client.HTTPResponse:
+		self.connection.request(method, url, body=data, headers=headers)
+		response = self.connection.getresponse()
+		response.read()
+		return response
+
+	def _reconnect(self) -> None:
+		self.connection.close()
+		self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+
+	def request(self, method: str, url: str, body: Optional[dict] = None) -> int:
+		"""
+		Send a request, with the cookies of the client. A request that fails twice is recorded with the status 0.
+
+		Returns:
+			int: The response status, 0 if the request failed.
+		"""
+		headers = {"Connection": "keep-alive"}
+		cookie = "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+
+		if cookie:
+			headers["Cookie"] = cookie
+
+		data = None
+
+		if body is not None:
+			data = json.dumps(body)
+			headers["Content-Type"] = "application/json"
+
+		start = time.perf_counter()
+
+		try:
+			response = self._send(method, url, data, headers)
+
+		except (http.client.HTTPException, OSError):
+			# The server may close an idle keep-alive connection: retry once on a new one
+			self._reconnect()
+
+			try:
+				response = self._send(method, url, data, headers)
+
+			except (http.client.HTTPException, OSError):
+				self._reconnect()
+				self.record(time.perf_counter() - start, 0, len(cookie), 0)
+				return 0
+
+		latency = time.perf_counter() - start
+		set_cookies = response.msg.get_all("Set-Cookie") or []
+
+		for header in set_cookies:
+			parsed = SimpleCookie()
+			parsed.load(header)
+
+			for name, morsel in parsed.items():
+				self.cookies[name] = morsel.coded_value
+
+		self.record(latency, response.status, len(cookie), sum(len(header) for header in set_cookies))
+		return response.status
+
+
+def browse(client: Client, rng: random.Random) -> None:
+	"""
+	Mostly product pages, sometimes the cart.
+	"""
+	if rng.random() < 0.8:
+		client.request("GET", f"/products/{rng.randrange(PRODUCTS)}")
+	else:
+		client.request("GET", "/api/cart")
+
+
+def add_heavy(client: Client, rng: random.Random) -> None:
+	"""
+	Mostly adding products, with some subtractions and cart views.
+	"""
+	roll = rng.random()
+	product_id = rng.randrange(PRODUCTS // 10)
+
+	if roll < 0.6:
+		client.request("POST", f"/api/cart/items/{product_id}", {"quantity": rng.randint(1, 3)})
+	elif roll < 0.7:
+		client.request("POST", f"/api/cart/items/{product_id}/subtract", {"quantity": 1})
+	else:
+		client.request("GET", "/api/cart")
+
+
+def checkout(client: Client, rng: random.Random) -> None:
+	"""
+	A full purchase: browse and add a few products, view the cart and check out.
+	"""
+	for _ in range(rng.randint(1, 5)):
+		product_id = rng.randrange(PRODUCTS)
+		client.request("GET", f"/products/{product_id}")
+		client.request("POST", f"/api/cart/items/{product_id}", {"quantity": 1})
+
+	client.request("GET", "/api/cart")
+	client.request("POST", "/checkout")
+
+
+SCENARIOS: dict[str, Callable[[Client, random.Random], None]] = {
+	"browse": browse,
+	"add-heavy": add_heavy,
+	"checkout": checkout,
+}
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+	if not sorted_values:
+		return 0.0
+
+	return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_scenario(port: int, scenario: str, clients: int, duration: float, seed: int) -> dict:
+	lock = threading.Lock()
+	latencies: list[float] = []
+	request_cookies: list[int] = []
+	response_cookies: list[int] = []
+	errors = 0
+
+	def record(latency: float, status: int, request_cookie: int, response_cookie: int) -> None:
+		nonlocal errors
+
+		with lock:
+			errors += not status or status >= 500
+
+			if not status:
+				return
+
+			latencies.append(latency)
+			request_cookies.append(request_cookie)
+			response_cookies.append(response_cookie)
+
+	deadline = time.monotonic() + duration
+
+	def run_client(index: int) -> None:
+		rng = random.Random(seed + index)
+		client = Client(port, record)
+
+		while time.monotonic() < deadline:
+			SCENARIOS[scenario](client, rng)
+
+	threads = [threading.Thread(target=run_client, args=(index,)) for index in range(clients)]
+	start = time.perf_counter()
+
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	elapsed = time.perf_counter() - start
+	latencies.sort()
+
+	return {
+		"requests": len(latencies),
+		"errors": errors,
+		"throughput": len(latencies) / elapsed,
+		"p50_ms": percentile(latencies, 0.50) * 1000,
+		"p95_ms": percentile(latencies, 0.95) * 1000,
+		"p99_ms": percentile(latencies, 0.99) * 1000,
+		"request_cookie_bytes": statistics.fmean(request_cookies) if request_cookies else 0.0,
+		"response_cookie_bytes": statistics.fmean(response_cookies) if response_cookies else 0.0,
+	}
+
+
+def free_port() -> int:
+	with socket.socket() as s:
+		s.bind(("127.0.0.1", 0))
+		return s.getsockname()[1]
+
+
+def wait_for(port: int, timeout: float = 15.0) -> None:
+	deadline = time.monotonic() + timeout
+
+	while time.monotonic() < deadline:
+		try:
+			with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+				return
+		except OSError:
+			time.sleep(0.1)
+
+	raise RuntimeError(f"The server did not start on port {port}.")
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+	parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+	parser.add_argument("--cookie-modes", nargs="+", choices=COOKIE_MODES, default=COOKIE_MODES, help="Cart cookie modes.")
+	parser.add_argument("--clients", type=int, default=16, help="Simulated clients per scenario.")
+	parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario and backend.")
+	parser.add_argument("--workers", type=int, default=4, help="Server worker processes, for the backends shared between processes.")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--json", help="Write the results to this file.")
+	parser.add_argument("--serve", help=argparse.SUPPRESS)
+	parser.add_argument("--cookie-mode", help=argparse.SUPPRESS)
+	parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+	parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.serve:
+		serve(args.serve, args.cookie_mode, args.port, args.workers, args.data_dir)
+		return
+
+	results = []
+	print(f"{'scenario':<10} {'backend':<20} {'cookie':<8} {'workers':>7} {'req':>7} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'cookie in':>10} {'cookie out':>10}")
+
+	for backend in args.backends:
+		workers = 1 if backend in IN_PROCESS_BACKENDS else args.workers
+
+		for cookie_mode in args.cookie_modes:
+			for scenario in args.scenarios:
+				port = free_port()
+
+				with tempfile.TemporaryDirectory() as data_dir:
+					server = subprocess.Popen(
+						[
+							sys.executable, os.path.abspath(__file__), "--serve", backend, "--cookie-mode", cookie_mode,
+							"--port", str(port), "--workers", str(workers), "--data-dir", data_dir,
+						],
+						stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+					)
+
+					try:
+						wait_for(port)
+						result = run_scenario(port, scenario, args.clients, args.duration, args.seed)
+					finally:
+						server.terminate()
+						server.wait()
+
+				result.update(scenario=scenario, backend=backend, cookie_mode=cookie_mode, workers=workers)
+				results.append(result)
+				print(
+					f"{scenario:<10} {backend:<20} {cookie_mode:<8} {workers:>7} {result['requests']:>7} {result['errors']:>4} {result['throughput']:>8.1f} "
+					f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+					f"{result['request_cookie_bytes']:>10.0f} {result['response_cookie_bytes']:>10.0f}"
+				)
+
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,20 @@
+from flask import Flask
+
+from src.flask_shoppingcart import FlaskShoppingCart, create_cart_blueprint
+
+app = Flask(__name__)
+app.config['SECRET_KEY'] = 'your_secret_key'
+
+shopping_cart = FlaskShoppingCart(app)
+
+# Sample stock of the products
+stock = {
+    str(i): 10
+    for i in range(1, 1000)
+}
+
+app.register_blueprint(create_cart_blueprint(shopping_cart, url_prefix='/api', get_stock=stock.get))
+
+
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -1,3 +1,17 @@
-from .exceptions import (OutOfStokError, ProductExtraDataNotFoundError,
+from .blueprint import create_cart_blueprint
+from .events import CartEvent, EventDispatcher
+from .exceptions import (CartLockTimeoutError, CartSchemaError,
+                         OutOfStokError, ProductExtraDataNotFoundError,
                          ProductNotFoundError, QuantityError)
 from .flask_shoppingcart import FlaskShoppingCart
+from .locks import (CartLock, FileCartLock, LockMetrics, NullCartLock,
+                    StripedCartLock)
+from .migrations import CartMigrations
+from .promotions import (BuyXGetY, Discount, FreeItemOver, PercentOff,
+                         PromotionEngine, Rule)
+from .reservations import (MemoryReservationLedger, ReservationLedger,
+                           SQLiteReservationLedger)
+from .snapshot import CartLine, CartSnapshot
+from .storage import (CartStore, MemoryCartStore, ShardedCartStore,
+                      ShardMetrics, SQLiteCartStore)
+from .validation import QuantityValidator, ValidationResult, Violation
\ No newline at end of file
@@ -1,17 +1,73 @@
 import json
+from contextlib import contextmanager, nullcontext
+from secrets import token_hex
+from uuid import uuid4
 
-from flask import Flask, Response, session, request
+from flask import Flask, Response, g, session, request
 
+from .events import CartEvent, EventDispatcher
+from .locks import CartLock, NullCartLock
+from .migrations import LEGACY_SCHEMA_VERSION, CartMigrations
 from .models import CartItem
+from .promotions import PromotionEngine
+from .reservations import ReservationLedger
+from .storage import CartStore
+from .validation import QuantityValidator
 
-from typing import Optional
+from typing import ContextManager, Iterator, Optional
 
 from .config import (FLASK_SHOPPING_CART_ALLOW_NEGATIVE_QUANTITY,
-                     FLASK_SHOPPING_CART_COOKIE_NAME)
+                     FLASK_SHOPPING_CART_COOKIE_MODE,
+                     FLASK_SHOPPING_CART_COOKIE_NAME,
+                     FLASK_SHOPPING_CART_COOKIE_SUMMARY_VERSION,
+                     FLASK_SHOPPING_CART_LOCK_TIMEOUT,
+                     FLASK_SHOPPING_CART_RESERVATION_TTL)
+
+
+def _copy_item(item: Optional[CartItem]) -> Optional[CartItem]:
+	"""
+	Copy a cart line, along with its extra data, so later changes of the line do not alter the copy.
+	"""
+	if item is None:
+		return None
+
+	copy: CartItem = dict(item)  # type: ignore
+
+	if "extra" in copy:
+		copy["extra"] = dict(copy["extra"])
+
+	return copy
+
+
+COOKIE_MODES = ("full", "summary", "off")
+
+#: Value of the copy-on-write state when a snapshot shares the cart and the cart itself was not copied yet.
+_SHARED = object()
 
 
 class ShoppingCartBase:
-	def __init__(self, app: Optional[Flask] = None) -> None:
+	def __init__(self,
+              app: Optional[Flask] = None,
+              reservations: Optional[ReservationLedger] = None,
+              lock: Optional[CartLock] = None,
+              promotions: Optional[PromotionEngine] = None,
+              events: Optional[EventDispatcher] = None,
+              storage: Optional[CartStore] = None,
+              migrations: Optional[CartMigrations] = None,
+              validator: Optional[QuantityValidator] = None
+              ) -> None:
+		self.reservations = reservations
+		self.lock: CartLock = lock if lock is not None else NullCartLock()
+		self.promotions = promotions
+		self.events = events
+		self.storage = storage
+		self.migrations = migrations
+		self.validator = validator
+
+		# Without a storage, every request changes its own copy of the cart and the session saved last wins anyway
+		if not self.lock.noop and storage is None:
+			raise ValueError("A cart lock requires a storage: without one, the lock protects nothing.")
+
 		if app is not None:
 			self.init_app(app)
 
@@ -19,41 +75,361 @@ class ShoppingCartBase:
 		app.after_request(self._after_request)
 		self.cookie_name: str = str(app.config.get("FLASK_SHOPPING_CART_COOKIE_NAME", FLASK_SHOPPING_CART_COOKIE_NAME))  # noqa
 		self.allow_negative_quantity: bool = bool(app.config.get("FLASK_SHOPPING_CART_ALLOW_NEGATIVE_QUANTITY", FLASK_SHOPPING_CART_ALLOW_NEGATIVE_QUANTITY))  # noqa
+		self.reservation_ttl: float = float(app.config.get("FLASK_SHOPPING_CART_RESERVATION_TTL", FLASK_SHOPPING_CART_RESERVATION_TTL))  # noqa
+		self.lock_timeout: Optional[float] = app.config.get("FLASK_SHOPPING_CART_LOCK_TIMEOUT", FLASK_SHOPPING_CART_LOCK_TIMEOUT)  # noqa
+		self.cookie_mode: str = str(app.config.get("FLASK_SHOPPING_CART_COOKIE_MODE", FLASK_SHOPPING_CART_COOKIE_MODE))  # noqa
+		self.cookie_summary_version: bool = bool(app.config.get("FLASK_SHOPPING_CART_COOKIE_SUMMARY_VERSION", FLASK_SHOPPING_CART_COOKIE_SUMMARY_VERSION))  # noqa
+
+		if self.cookie_mode not in COOKIE_MODES:
+			raise ValueError(f"FLASK_SHOPPING_CART_COOKIE_MODE must be one of {', '.join(COOKIE_MODES)}.")
 
 	def _after_request(self, response: Response) -> Response:
-		self._set_cookie(response)
+		# A 304 Not Modified tells the client its copy of the cart is current: the cookie is not sent again
+		if response.status_code != 304:
+			self._set_cookie(response)
+
 		return response
 
 	def _set_cookie(self, response: Response):
 		"""
-		Set the cookie with the shopping cart data.
-		This method will serialize the shopping cart data to JSON and set it as a cookie in the response headers.
+		Set the cookie with the shopping cart data, according to `FLASK_SHOPPING_CART_COOKIE_MODE`:
+		- `full`: the shopping cart data serialized to JSON.
+		- `summary`: the line count and the total quantity, and the cart version if `FLASK_SHOPPING_CART_COOKIE_SUMMARY_VERSION` is set,
+			separated by colons (e.g. `2:5`). It is only set when it changes.
+		- `off`: no cookie. A cookie sent by the browser is deleted.
 		
 		Args:
 			response (Response): The response object to set the cookie in.
 		"""
-		if not session.get(self.cookie_name):
+		if self.cookie_mode == "off":
+			if self.cookie_name in request.cookies:
+				response.delete_cookie(self.cookie_name)
+
+			return
+
+		if self.cookie_mode == "summary":
+			value = ":".join(str(value) for value in self._get_summary())
+
+			if self.cookie_summary_version:
+				value = f"{value}:{self._get_cart_version() or ''}"
+
+			if request.cookies.get(self.cookie_name) != value:
+				response.set_cookie(self.cookie_name, value)
+
+			return
+
+		if self.storage is None and not session.get(self.cookie_name):
 			self._set_cart({})
 
 		response.set_cookie(self.cookie_name, json.dumps(self._get_cart()))
 
+	def _get_summary(self) -> list:
+		"""
+		Get the summary of the cart: the line count and the total quantity.
+		The summary is kept in the session and updated on every change of the cart, so the cart is not read to get it.
+		It is not kept for an empty session, so visitors without a cart do not get a session.
+
+		If a storage is set, the cart is shared by the concurrent requests of the session, and the session saved last
+		could hold a stale summary: the summary is computed from the stored cart instead, read once per request.
+
+		Returns:
+			list: The line count and the total quantity.
+		"""
+		if self.storage is not None:
+			cart = self._get_cart()
+			return [len(cart), sum(item["quantity"] for item in cart.values())]  # type: ignore
+
+		key = f"{self.cookie_name}_summary"
+		summary = session.get(key)
+
+		if summary is None:
+			cart = self._get_cart()
+			summary = [len(cart), sum(item["quantity"] for item in cart.values())]  # type: ignore
+
+			if session:
+				session[key] = summary
+
+		return summary
+
+	def _update_summary(self, product_id: Optional[str], old: Optional[CartItem], new: Optional[CartItem]) -> None:
+		"""
+		Update the summary of the cart with a change of a line, without reading the rest of the cart.
+		"""
+		key = f"{self.cookie_name}_summary"
+		summary = session.get(key)
+
+		if summary is None:
+			self._get_summary()
+			return
+
+		if product_id is None:
+			session[key] = [0, 0]
+			return
+
+		lines, quantity = summary
+		session[key] = [
+			lines + (new is not None) - (old is not None),
+			quantity + (new["quantity"] if new is not None else 0) - (old["quantity"] if old is not None else 0),  # type: ignore
+		]
+
 	def _get_cart(self) -> dict[str, CartItem]:
 		"""
 		Get the cart data.
+		If a storage is set, the cart is read from it once per request (and again when the cart is locked).
+		If the cart has an old schema version, it is upgraded (see `_upgrade_cart`).
 		
 		Returns:
 			dict: The cart data.
 		"""
-		return session.get(self.cookie_name, dict())
+		if self.storage is None:
+			cart = session.get(self.cookie_name, dict())
+
+		else:
+			cart = self._get_stored()["lines"]
+
+		if self.migrations is None:
+			return cart
+
+		return self._upgrade_cart(cart)
+
+	def _get_stored(self) -> dict:
+		"""
+		Get the record of the cart in the storage: the lines (`lines`), the version of the cart (`version`)
+		and, if migrations are set, the schema version of the lines (`schema`).
+		The version is stored along with the lines, so concurrent requests of a session cannot leave
+		a session cookie with a version that belongs to another cart.
+		The record is read once per request (and again when the cart is locked), and written by `_flush_cart`.
+
+		Returns:
+			dict: The record of the cart. An empty record if the cart is not stored.
+		"""
+		key = f"_{self.cookie_name}_stored_cart"
+		stored = g.get(key)
+
+		if stored is None:
+			cart_id = session.get(f"{self.cookie_name}_id")
+			stored = dict((self.storage.get(cart_id) if cart_id is not None else None) or {"lines": {}})  # type: ignore
+			setattr(g, key, stored)
+
+		return stored
+
+	def _flush_cart(self) -> None:
+		"""
+		Write the record of the cart to the storage, if it was changed during the request.
+		An empty cart is deleted from the storage instead.
+		"""
+		if not g.pop(f"_{self.cookie_name}_stored_changed", False):
+			return
+
+		stored = self._get_stored()
+
+		if stored["lines"]:
+			self.storage.set(self._get_cart_id(), stored)  # type: ignore
+
+		elif f"{self.cookie_name}_id" in session:
+			self.storage.delete(session[f"{self.cookie_name}_id"])  # type: ignore
+
+	def _get_schema_version(self) -> int:
+		"""
+		Get the schema version of the cart as read. It is kept in the session, or along with the cart if a storage is set,
+		so a request with an old session does not upgrade a cart that was already upgraded.
+
+		Returns:
+			int: The schema version, `LEGACY_SCHEMA_VERSION` if the cart has none.
+		"""
+		if self.storage is not None:
+			return self._get_stored().get("schema", LEGACY_SCHEMA_VERSION)
+
+		return session.get(f"{self.cookie_name}_schema", LEGACY_SCHEMA_VERSION)
+
+	def _upgrade_cart(self, cart: dict[str, CartItem]) -> dict[str, CartItem]:
+		"""
+		Upgrade a cart read with an old schema version to the current one.
+		The upgraded cart is kept for the rest of the request, but it is only written back when the cart is changed.
+
+		Args:
+			cart (dict): The cart data as read.
+
+		Returns:
+			dict: The upgraded cart data, or the same cart if its version is current.
+
+		Raises:
+			CartSchemaError: If the cart cannot be upgraded.
+		"""
+		version = self._get_schema_version()
+
+		if version == self.migrations.version:  # type: ignore
+			return cart
+
+		key = f"_{self.cookie_name}_upgraded_cart"
+		upgraded = g.get(key)
+
+		# The cart read may change during the request, e.g. when it is read again from the storage
+		if upgraded is None or upgraded[0] is not cart:
+			upgraded = (cart, self.migrations.upgrade(cart, version))  # type: ignore
+			setattr(g, key, upgraded)
+
+		return upgraded[1]
 
 	def _set_cart(self, cart: dict[str, CartItem]) -> None:
 		"""
 		Set the cart data.
+		If a storage is set, the cart is written to it with its new version when the cart lock is released (see `_lock_cart`).
 		
 		Args:
 			cart (dict): The cart data to set.
 		"""
-		session[self.cookie_name] = cart
+		if self.storage is None:
+			if self.migrations is not None and self._get_schema_version() != self.migrations.version:
+				session[f"{self.cookie_name}_schema"] = self.migrations.version
+
+			session[self.cookie_name] = cart
+			return
+
+		stored = self._get_stored()
+		stored["lines"] = cart
+
+		if self.migrations is not None:
+			stored["schema"] = self.migrations.version
+
+		setattr(g, f"_{self.cookie_name}_stored_changed", True)
+
+	def _share_cart(self) -> None:
+		"""
+		Mark the cart as shared by a snapshot, so the next changes of the request copy what they change.
+		"""
+		setattr(g, f"_{self.cookie_name}_owned_lines", _SHARED)
+
+	def _get_cart_for_write(self, product_id: Optional[str] = None) -> dict[str, CartItem]:
+		"""
+		Get the cart data to be changed.
+		If a snapshot shares the cart, the cart and the line of `product_id` are copied first (copy-on-write),
+		so the snapshot is not altered. Each line is copied once per snapshot.
+
+		Args:
+			product_id (str, optional): The ID of the product whose line will be changed in place.
+
+		Returns:
+			dict: The cart data.
+		"""
+		cart = self._get_cart()
+		key = f"_{self.cookie_name}_owned_lines"
+		owned = g.get(key)
+
+		if owned is None:
+			return cart
+
+		if owned is _SHARED:
+			cart = dict(cart)
+			owned = set()
+			setattr(g, key, owned)
+			self._set_cart(cart)
+
+		if product_id is not None and product_id not in owned and product_id in cart:
+			cart[product_id] = _copy_item(cart[product_id])  # type: ignore
+			owned.add(product_id)
+
+		return cart
+
+	def _get_cart_id(self) -> str:
+		"""
+		Get the ID of the cart, creating it if the session has none.
+		The ID identifies the cart outside of the session, as the holder of its stock reservations.
+
+		Returns:
+			str: The cart ID.
+		"""
+		key = f"{self.cookie_name}_id"
+		cart_id = session.get(key)
+
+		if cart_id is None:
+			cart_id = session[key] = uuid4().hex
+
+		return cart_id
+
+	def _get_cart_version(self) -> Optional[str]:
+		"""
+		Get the version of the cart. A new version is stamped on every change of the cart.
+		It is kept in the session, or along with the cart if a storage is set.
+
+		Returns:
+			str: The cart version, None if the cart was never changed.
+		"""
+		if self.storage is not None:
+			return self._get_stored().get("version")
+
+		return session.get(f"{self.cookie_name}_version")
+
+	def _changed(self,
+              operation: str,
+              product_id: Optional[str],
+              old: Optional[CartItem],
+              new: Optional[CartItem],
+              cleared: Optional[dict[str, CartItem]] = None
+              ) -> None:
+		"""
+		Called after every change of the cart. It stamps a new version of the cart, updates the cart summary,
+		notifies the promotion engine and publishes the change to the events dispatcher.
+
+		Args:
+			operation (str): The name of the method that changed the cart.
+			product_id (str, optional): The ID of the changed product. None if the cart was cleared.
+			old (CartItem, optional): A copy of the line before the change. None if it was added.
+			new (CartItem, optional): A copy of the line after the change. None if it was removed.
+			cleared (dict, optional): The lines removed when the cart was cleared. An event is published for each of them.
+		"""
+		old_version = self._get_cart_version()
+		version = token_hex(8)
+
+		if self.storage is None:
+			session[f"{self.cookie_name}_version"] = version
+
+		else:
+			self._get_stored()["version"] = version
+			setattr(g, f"_{self.cookie_name}_stored_changed", True)
+
+		if self.promotions is not None:
+			self.promotions.notify(self._get_cart_id(), old_version, version, product_id, old, new)
+
+		if self.cookie_mode == "summary" and self.storage is None:
+			self._update_summary(product_id, old, new)
+
+		if self.events is None:
+			return
+
+		if cleared is None:
+			self.events.publish(CartEvent.from_change(operation, self._get_cart_id(), product_id, old, new, version))
+			return
+
+		for cleared_id, item in cleared.items():
+			self.events.publish(CartEvent.from_change(operation, self._get_cart_id(), cleared_id, item, None, version))
+
+	def _lock_cart(self) -> ContextManager:
+		"""
+		Lock the cart of the current session until the context exits.
+		If a storage is set, the changes of the cart are written to it when the context exits, before the lock is released.
+		With the default `NullCartLock`, no cart ID is created.
+
+		Raises:
+			CartLockTimeoutError: If the lock could not be acquired before `FLASK_SHOPPING_CART_LOCK_TIMEOUT` seconds.
+		"""
+		if self.storage is None:
+			return nullcontext()
+
+		return self._locked()
+
+	@contextmanager
+	def _locked(self) -> Iterator[None]:
+		with nullcontext() if self.lock.noop else self.lock.lock(self._get_cart_id(), self.lock_timeout):
+			# The cart read before the lock was acquired may be stale: read it again from the storage
+			if not self.lock.noop and not g.get(f"_{self.cookie_name}_stored_changed"):
+				g.pop(f"_{self.cookie_name}_stored_cart", None)
+
+			try:
+				yield
+
+			finally:
+				self._flush_cart()
 
 	def _get_cookie_cart(self) -> str:
 		return request.cookies.get(self.cookie_name, str(dict()))
\ No newline at end of file
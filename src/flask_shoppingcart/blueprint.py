@@ -0,0 +1,186 @@
+import math
+from numbers import Number
+from typing import Callable, Optional
+
+from flask import Blueprint, Response, jsonify, request
+from werkzeug.exceptions import BadRequest
+
+from .exceptions import (CartLockTimeoutError, OutOfStokError,
+                         ProductExtraDataNotFoundError, ProductNotFoundError,
+                         QuantityError)
+from .flask_shoppingcart import FlaskShoppingCart
+
+
+def create_cart_blueprint(shopping_cart: FlaskShoppingCart,
+                          name: str = "shopping_cart",
+                          url_prefix: Optional[str] = None,
+                          get_stock: Optional[Callable[[str], Optional[Number]]] = None
+                          ) -> Blueprint:
+	"""
+	Create a blueprint with a JSON API over the cart.
+
+	Every response carries an ETag derived from the cart version, so:
+	- `GET` requests with a matching `If-None-Match` header are answered with an empty `304 Not Modified`: neither the body nor the cart cookie
+		carries the cart, as the client already has it.
+	- Changes with an `If-Match` header that does not match the current cart are rejected with `412 Precondition Failed`.
+
+	Routes:
+		- `GET /cart`: The cart.
+		- `DELETE /cart`: Clear the cart.
+		- `POST /cart/items/<product_id>`: Add a product. JSON body: `quantity`, `overwrite_quantity`, `extra`, `overwrite_extra`.
+		- `POST /cart/items/<product_id>/subtract`: Subtract a quantity. JSON body: `quantity`.
+		The `POST` and `PATCH` routes require a JSON object as body (`{}` for the defaults), so plain HTML forms
+		from other sites cannot change the cart.
+		- `GET /cart/items/<product_id>`: A product of the cart.
+		- `DELETE /cart/items/<product_id>`: Remove a product.
+		- `GET /cart/items/<product_id>/extra`: The extra data of a product.
+		- `PATCH /cart/items/<product_id>/extra`: Add extra data to a product. JSON body: the extra data. `?overwrite=1` replaces it.
+		- `DELETE /cart/items/<product_id>/extra`: Clear the extra data of a product.
+		- `DELETE /cart/items/<product_id>/extra/<key>`: Remove a key of the extra data of a product.
+
+	Args:
+		shopping_cart (FlaskShoppingCart): The cart extension the blueprint works with.
+		name (str): The name of the blueprint.
+		url_prefix (str, optional): The URL prefix of the routes.
+		get_stock (Callable, optional): Returns the current stock of a product, to validate and reserve it when adding.
+			The stock is never read from the request.
+
+	Returns:
+		Blueprint: The blueprint, to be registered in the application.
+	"""
+	blueprint = Blueprint(name, __name__, url_prefix=url_prefix)
+
+	def etag() -> str:
+		return shopping_cart._get_cart_version() or "empty"
+
+	def cart_response() -> Response:
+		return jsonify(shopping_cart.get_cart())
+
+	def not_modified() -> Optional[Response]:
+		if request.if_none_match.contains_weak(etag()):
+			return Response(status=304)
+
+		return None
+
+	def change(method: Callable, *args, **kwargs) -> Response:
+		with shopping_cart._lock_cart():
+			if request.if_match and not request.if_match.contains(etag()):
+				return Response(status=412)
+
+			method(*args, **kwargs)
+
+		return cart_response()
+
+	def json_body() -> dict:
+		data = request.get_json(silent=True) if request.is_json else None
+
+		if not isinstance(data, dict):
+			raise BadRequest("The request body must be a JSON object.")
+
+		return data
+
+	def quantity_of(data: dict) -> Number:
+		quantity = data.get("quantity", 1)
+
+		if isinstance(quantity, bool) or not isinstance(quantity, (int, float)) or not math.isfinite(quantity):
+			raise BadRequest("The quantity must be a number.")
+
+		if quantity <= 0 and not shopping_cart.allow_negative_quantity:
+			raise BadRequest("The quantity must be greater than 0.")
+
+		return quantity
+
+	def extra_of(data: dict) -> Optional[dict]:
+		extra = data.get("extra")
+
+		if extra is not None and not isinstance(extra, dict):
+			raise BadRequest("The extra data must be a JSON object.")
+
+		return extra
+
+	@blueprint.after_request
+	def set_etag(response: Response) -> Response:
+		if response.status_code in (200, 304, 412):
+			response.set_etag(etag())
+
+		response.headers["Cache-Control"] = "private, no-cache"
+		response.vary.add("Cookie")
+		return response
+
+	@blueprint.get("/cart")
+	def view_cart():
+		return not_modified() or cart_response()
+
+	@blueprint.delete("/cart")
+	def clear_cart():
+		return change(shopping_cart.clear)
+
+	@blueprint.post("/cart/items/<product_id>")
+	def add_product(product_id: str):
+		data = json_body()
+
+		return change(
+			shopping_cart.add,
+			product_id,
+			quantity_of(data),
+			overwrite_quantity=bool(data.get("overwrite_quantity", False)),
+			current_stock=get_stock(product_id) if get_stock is not None else None,
+			extra=extra_of(data),
+			overwrite_extra=bool(data.get("overwrite_extra", False)),
+		)
+
+	@blueprint.post("/cart/items/<product_id>/subtract")
+	def subtract_product(product_id: str):
+		return change(
+			shopping_cart.subtract,
+			product_id,
+			quantity_of(json_body()),
+			autoremove_if_0=not shopping_cart.allow_negative_quantity,
+		)
+
+	@blueprint.get("/cart/items/<product_id>")
+	def view_product(product_id: str):
+		return not_modified() or jsonify(shopping_cart.get_product(product_id))
+
+	@blueprint.delete("/cart/items/<product_id>")
+	def remove_product(product_id: str):
+		return change(shopping_cart.remove, product_id, silent=False)
+
+	@blueprint.get("/cart/items/<product_id>/extra")
+	def view_extra_data(product_id: str):
+		return not_modified() or jsonify(shopping_cart.get_extra_data(product_id) or {})
+
+	@blueprint.patch("/cart/items/<product_id>/extra")
+	def add_extra_data(product_id: str):
+		return change(
+			shopping_cart.add_extra_data,
+			product_id,
+			json_body(),
+			overwrite=request.args.get("overwrite", "").lower() in ("1", "true"),
+		)
+
+	@blueprint.delete("/cart/items/<product_id>/extra")
+	def clear_extra_data(product_id: str):
+		return change(shopping_cart.clear_extra_data, product_id)
+
+	@blueprint.delete("/cart/items/<product_id>/extra/<key>")
+	def remove_extra_data(product_id: str, key: str):
+		return change(shopping_cart.remove_extra_data, product_id, key, silent=False)
+
+	def error(status: int) -> Callable:
+		def handler(e: Exception):
+			return jsonify({"error": type(e).__name__, "message": str(e)}), status
+
+		return handler
+
+	def bad_request(e: BadRequest):
+		return jsonify({"error": type(e).__name__, "message": e.description}), 400
+
+	blueprint.register_error_handler(ProductNotFoundError, error(404))
+	blueprint.register_error_handler(ProductExtraDataNotFoundError, error(404))
+	blueprint.register_error_handler(OutOfStokError, error(409))
+	blueprint.register_error_handler(QuantityError, error(400))
+	blueprint.register_error_handler(BadRequest, bad_request)
+	blueprint.register_error_handler(CartLockTimeoutError, error(503))
+
+	return blueprint
@@ -1,2 +1,6 @@
 FLASK_SHOPPING_CART_COOKIE_NAME = "products"
-FLASK_SHOPPING_CART_ALLOW_NEGATIVE_QUANTITY = 0
\ No newline at end of file
+FLASK_SHOPPING_CART_ALLOW_NEGATIVE_QUANTITY = 0
+FLASK_SHOPPING_CART_RESERVATION_TTL = 900
+FLASK_SHOPPING_CART_LOCK_TIMEOUT = 10
+FLASK_SHOPPING_CART_COOKIE_MODE = "full"
+FLASK_SHOPPING_CART_COOKIE_SUMMARY_VERSION = 0
\ No newline at end of file
@@ -0,0 +1,242 @@
+import logging
+import os
+import queue
+import threading
+import time
+from numbers import Number
+from typing import Any, Callable, NamedTuple, Optional
+
+from .models import CartItem
+
+logger = logging.getLogger(__name__)
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+
+class CartEvent(NamedTuple):
+	"""
+	A change of a cart.
+	"""
+	operation: str
+	cart_id: str
+	product_id: Optional[str]
+	old_quantity: Optional[Number]
+	new_quantity: Optional[Number]
+	extra_changed: dict
+	extra_removed: tuple
+	version: Optional[str]
+	timestamp: float
+
+	@classmethod
+	def from_change(cls, operation: str, cart_id: str, product_id: Optional[str], old: Optional[CartItem], new: Optional[CartItem], version: Optional[str]) -> "CartEvent":
+		"""
+		Build the event of a change of a cart line.
+
+		Args:
+			operation (str): The name of the method that changed the cart.
+			cart_id (str): The ID of the cart.
+			product_id (str, optional): The ID of the changed product. A cleared cart publishes an event for each of its lines.
+			old (CartItem, optional): The line before the change. None if it was added.
+			new (CartItem, optional): The line after the change. None if it was removed.
+			version (str, optional): The version of the cart after the change.
+
+		Returns:
+			CartEvent: The event, with the extra data keys that were added or updated and the ones that were removed.
+		"""
+		old_extra: dict = (old or {}).get("extra") or {}
+		new_extra: dict = (new or {}).get("extra") or {}
+
+		return cls(
+			operation,
+			cart_id,
+			product_id,
+			old["quantity"] if old is not None else None,
+			new["quantity"] if new is not None else None,
+			{key: value for key, value in new_extra.items() if key not in old_extra or old_extra[key] != value},
+			tuple(key for key in old_extra if key not in new_extra),
+			version,
+			time.time(),
+		)
+
+
+class EventDispatcher:
+	"""
+	Delivers the cart events to a handler from a background thread, so publishing never waits for the consumers.
+
+	The events are buffered in a bounded queue and handed to the handler in batches. When the queue is full:
+	- `drop_newest`: the new event is dropped.
+	- `drop_oldest`: the oldest buffered event is dropped to make room for the new one.
+	- `block`: the publisher waits up to `block_timeout` seconds for room, then drops the new event.
+	"""
+
+	def __init__(self,
+	             handler: Callable[[list[CartEvent]], Any],
+	             max_queue: int = 10000,
+	             batch_size: int = 100,
+	             flush_interval: float = 0.5,
+	             overflow: str = DROP_NEWEST,
+	             block_timeout: float = 0.05
+	             ) -> None:
+		"""
+		Args:
+			handler (Callable): Receives each batch of events. Its exceptions are logged and the batch is discarded.
+			max_queue (int): The maximum number of buffered events.
+			batch_size (int): The maximum number of events per batch.
+			flush_interval (float): Seconds the worker waits for more events before delivering a partial batch.
+			overflow (str): What to do when the queue is full: `drop_newest`, `drop_oldest` or `block`.
+			block_timeout (float): Seconds the publisher waits for room with the `block` policy.
+		"""
+		if overflow not in (DROP_NEWEST, DROP_OLDEST, BLOCK):
+			raise ValueError(f"Unknown overflow policy: {overflow}.")
+
+		self.handler = handler
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.overflow = overflow
+		self.block_timeout = block_timeout
+		self.max_queue = max_queue
+
+		self.published = 0
+		self.dropped = 0
+		self.delivered = 0
+		self.failed = 0
+
+		self._queue: queue.Queue = queue.Queue(max_queue)
+		self._lock = threading.Lock()
+		self._thread: Optional[threading.Thread] = None
+		self._pid: Optional[int] = None
+		self._closed = False
+
+	def _ensure_worker(self) -> None:
+		# The worker is started on the first event, and again in a forked worker process, which does not inherit threads
+		if self._thread is not None and self._pid == os.getpid():
+			return
+
+		with self._lock:
+			if self._thread is None or self._pid != os.getpid():
+				self._pid = os.getpid()
+				self._queue = queue.Queue(self.max_queue)
+				self._thread = threading.Thread(target=self._run, name="flask-shoppingcart-events", daemon=True)
+				self._thread.start()
+
+	def publish(self, event: CartEvent) -> bool:
+		"""
+		Buffer an event to be delivered by the background thread.
+
+		Args:
+			event (CartEvent): The event to publish.
+
+		Returns:
+			bool: False if the event was dropped.
+		"""
+		if self._closed:
+			return False
+
+		self._ensure_worker()
+
+		try:
+			if self.overflow == BLOCK:
+				self._queue.put(event, timeout=self.block_timeout)
+			else:
+				self._queue.put_nowait(event)
+
+		except queue.Full:
+			if self.overflow != DROP_OLDEST:
+				return self._drop()
+
+			try:
+				self._queue.get_nowait()
+				self._drop()
+				self._queue.put_nowait(event)
+
+			except (queue.Empty, queue.Full):
+				return self._drop()
+
+		with self._lock:
+			self.published += 1
+
+		return True
+
+	def _drop(self) -> bool:
+		with self._lock:
+			self.dropped += 1
+
+		return False
+
+	def _run(self) -> None:
+		events = self._queue
+
+		while True:
+			event = events.get()
+
+			if event is None:
+				return
+
+			batch = [event]
+			deadline = time.monotonic() + self.flush_interval
+			stop = False
+
+			while len(batch) < self.batch_size:
+				try:
+					event = events.get(timeout=max(0.0, deadline - time.monotonic()))
+
+				except queue.Empty:
+					break
+
+				if event is None:
+					stop = True
+					break
+
+				batch.append(event)
+
+			self._deliver(batch)
+
+			if stop:
+				return
+
+	def _deliver(self, batch: list[CartEvent]) -> None:
+		try:
+			self.handler(batch)
+
+		except Exception:
+			logger.exception("The cart events handler failed, %d events were discarded.", len(batch))
+
+			with self._lock:
+				self.failed += len(batch)
+
+		else:
+			with self._lock:
+				self.delivered += len(batch)
+
+	def close(self, timeout: Optional[float] = None) -> None:
+		"""
+		Stop accepting events, and wait for the buffered ones to be delivered.
+
+		Args:
+			timeout (float, optional): Seconds to wait for the worker. If None, it waits until all events are delivered.
+		"""
+		self._closed = True
+
+		if self._thread is None or self._pid != os.getpid():
+			return
+
+		self._queue.put(None)
+		self._thread.join(timeout)
+
+	def stats(self) -> dict:
+		"""
+		Get the counters of the dispatcher.
+
+		Returns:
+			dict: The number of published, dropped, delivered and failed events, and the current queue size.
+		"""
+		with self._lock:
+			return {
+				"published": self.published,
+				"dropped": self.dropped,
+				"delivered": self.delivered,
+				"failed": self.failed,
+				"queued": self._queue.qsize(),
+			}
@@ -8,4 +8,10 @@ class ProductExtraDataNotFoundError(Exception):
     pass
 
 class QuantityError(Exception):
+    pass
+
+class CartLockTimeoutError(Exception):
+    pass
+
+class CartSchemaError(Exception):
     pass
\ No newline at end of file
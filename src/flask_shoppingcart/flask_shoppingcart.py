@@ -1,11 +1,37 @@
-from functools import partial
+from decimal import Decimal
+from functools import partial, wraps
 from numbers import Number
-from typing import Any, Optional, Union
+from typing import Any, Callable, Iterable, Mapping, Optional, TypeVar, Union
 
-from ._shoppingcart import ShoppingCartBase
+from ._shoppingcart import ShoppingCartBase, _copy_item
 from .exceptions import OutOfStokError, ProductNotFoundError, QuantityError
 from .manage_cart_item_extra_data import ManageCartItemExtraData
 from .models import CartItem
+from .promotions import Discount
+from .snapshot import CartSnapshot
+from .validation import QuantityValidator, StockGetter, ValidationResult
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def _to_cart_quantity(quantity: Decimal) -> Number:
+	"""
+	Convert a normalized quantity to the type kept in the cart. The cart is stored as JSON, which has no `Decimal`:
+	whole quantities are kept as ints, and the others as floats.
+	"""
+	return int(quantity) if quantity == quantity.to_integral_value() else float(quantity)  # type: ignore
+
+
+def _locked(method: _F) -> _F:
+	"""
+	Run the decorated method holding the lock of the current cart, so concurrent changes of the same cart do not overlap.
+	"""
+	@wraps(method)
+	def wrapper(self: "FlaskShoppingCart", *args, **kwargs):
+		with self._lock_cart():
+			return method(self, *args, **kwargs)
+
+	return wrapper  # type: ignore
 
 
 class FlaskShoppingCart(ShoppingCartBase):
@@ -38,6 +64,160 @@ class FlaskShoppingCart(ShoppingCartBase):
 		):
 			raise OutOfStokError()
 
+	def _hold_stock(self, product_id: str, quantity: Number, current_stock: Optional[Number] = None) -> None:
+		"""
+		Reserves the stock of a product for the cart, if a reservation ledger is set.
+		- If `current_stock` is provided, the hold is created or replaced after validating it against the stock not held by other carts.
+		- If `current_stock` is not provided, only an existing hold is updated and renewed. A quantity of 0 or less releases it.
+
+		Args:
+			product_id (str): The ID of the product.
+			quantity (Number): The total quantity of the product in the cart.
+			current_stock (Number, optional): The current stock of the product.
+
+		Raises:
+			OutOfStokError: If the quantity exceeds the stock not held by other carts.
+		"""
+		if self.reservations is None:
+			return
+
+		if current_stock is None:
+			self.reservations.adjust(product_id, self._get_cart_id(), quantity, self.reservation_ttl)
+
+		else:
+			self.reservations.reserve(product_id, self._get_cart_id(), quantity, current_stock, self.reservation_ttl)
+
+	def _hold_stock_many(self, quantities: Mapping[str, Number], stocks: Mapping[str, Optional[Number]]) -> None:
+		"""
+		Reserves the stock of many products for the cart, if a reservation ledger is set: either every hold is taken,
+		or none is. If a hold is refused, the holds already taken are put back as they were.
+
+		Args:
+			quantities (Mapping[str, Number]): The total quantity of each product in the cart.
+			stocks (Mapping[str, Number]): The current stock of the products, if known.
+
+		Raises:
+			OutOfStokError: If a quantity exceeds the stock not held by other carts.
+		"""
+		if self.reservations is None:
+			return
+
+		cart_id = self._get_cart_id()
+		previous: dict[str, Number] = {}
+
+		try:
+			for product_id, quantity in quantities.items():
+				previous[product_id] = self.reservations.get_hold(product_id, cart_id)
+				self._hold_stock(product_id, quantity, stocks.get(product_id))
+
+		except Exception:
+			for product_id, held in previous.items():
+				if held:
+					self.reservations.adjust(product_id, cart_id, held, self.reservation_ttl)
+
+				else:
+					self.reservations.release(product_id, cart_id)
+
+			raise
+
+	def _release_stock(self, product_ids: Iterable[str]) -> None:
+		"""
+		Releases the stock held by the cart for the given products, if a reservation ledger is set.
+
+		Args:
+			product_ids (Iterable[str]): The IDs of the products to release.
+		"""
+		if self.reservations is not None:
+			self.reservations.release_all(self._get_cart_id(), product_ids)
+
+	def _get_validator(self) -> QuantityValidator:
+		"""
+		Get the validator of the bulk changes: the one set, or a validator following `FLASK_SHOPPING_CART_ALLOW_NEGATIVE_QUANTITY`.
+		"""
+		if self.validator is not None:
+			return self.validator
+
+		return QuantityValidator(allow_negative=self.allow_negative_quantity)
+
+	def _get_stock_for_cart(self, get_stock: Optional[StockGetter]) -> Optional[StockGetter]:
+		"""
+		Wrap a stock getter so it returns the stock the cart can have: the stock not held by other carts,
+		if a reservation ledger is set.
+		"""
+		if get_stock is None or self.reservations is None:
+			return get_stock
+
+		reservations = self.reservations
+		cart_id = self._get_cart_id()
+
+		def get_stock_for_cart(product_id: str) -> Optional[Number]:
+			stock = get_stock(product_id)
+
+			if stock is None:
+				return None
+
+			return stock - (reservations.held(product_id) - reservations.get_hold(product_id, cart_id))  # type: ignore
+
+		return get_stock_for_cart
+
+	@property
+	def cart_id(self) -> str:
+		"""
+		Get the ID of the cart. The ID is created and stored in the session the first time it is requested.
+
+		Returns:
+			str: The cart ID.
+		"""
+		return self._get_cart_id()
+
+	def get_available_stock(self, product_id: str, current_stock: Number) -> Number:
+		"""
+		Get the stock of a product that is not held by any cart.
+		If no reservation ledger is set, the current stock is returned.
+
+		Args:
+			product_id (str): The ID of the product.
+			current_stock (Number): The current stock of the product.
+
+		Returns:
+			Number: The available stock.
+		"""
+		if self.reservations is None:
+			return current_stock
+
+		return self.reservations.available(product_id, current_stock)
+
+	def get_discounts(self) -> list[Discount]:
+		"""
+		Get the discounts applied to the cart by the promotion engine.
+		If no promotion engine is set, or the cart is empty, no discounts are returned and no cart ID is created.
+
+		Returns:
+			list[Discount]: The applied discounts, in the order of the rules.
+		"""
+		if self.promotions is None:
+			return []
+
+		cart = self._get_cart()
+
+		if not cart:
+			return []
+
+		return self.promotions.evaluate(self._get_cart_id(), self._get_cart_version(), cart)
+
+	def snapshot(self) -> CartSnapshot:
+		"""
+		Get a read-only snapshot of the cart.
+		The snapshot copies nothing; later changes of the cart copy the lines they change, so the snapshot is not altered.
+
+		Returns:
+			CartSnapshot: The snapshot of the cart, with its version.
+		"""
+		self._share_cart()
+		total_quantity = self._get_summary()[1] if self.cookie_mode == "summary" else None
+
+		return CartSnapshot(self._get_cart(), self._get_cart_version(), total_quantity)
+
 	def get_cart(self) -> dict[str, CartItem]:
 		"""
 		Get the cart data.
@@ -47,6 +227,7 @@ class FlaskShoppingCart(ShoppingCartBase):
 		"""
 		return self._get_cart()
 
+	@_locked
 	def add(self,
          product_id: str,
          quantity: Number = 1,  # type: ignore
@@ -70,46 +251,128 @@ class FlaskShoppingCart(ShoppingCartBase):
 
 		Raises:
 			OutOfStokError: If the product is out of stock. This error is raise if the ignore_stock is True and the quantity exceeds the current stock.
+				If a reservation ledger is set, it is also raised when the quantity exceeds the stock not held by other carts.
 		"""
-		cart: dict[str, CartItem] = self._get_cart()
+		cart: dict[str, CartItem] = self._get_cart_for_write(product_id)
 
 		_allow_negative = allow_negative or self.allow_negative_quantity
 
 		if not _allow_negative and quantity <= 0:  # type: ignore
 			raise ValueError("Quantity must be greater than 0.")
 
-		product: Optional[CartItem] = cart.get(product_id, None)
-
-		_data: CartItem = {
-			"quantity": quantity,
-		}
+		old_product: Optional[CartItem] = _copy_item(cart.get(product_id, None))
 
 		_validate_stock: partial = partial(
 			self._validate_stock, current_stock, quantity)
 
-		# Product data
-		if product:
-			_validate_stock(product["quantity"])
+		# Product data, on a copy of the line, so nothing is changed nor held if the extra data is rejected
+		if old_product:
+			_validate_stock(old_product["quantity"])
+			product: CartItem = _copy_item(old_product)  # type: ignore
 
 			if overwrite_quantity:
-				product.update(_data)
+				product["quantity"] = quantity
 
 			else:
 				product["quantity"] += quantity  # type: ignore
 
 		else:
-			product = _data
 			_validate_stock(0)
+			product = {
+				"quantity": quantity,
+			}
 
 		# Extra data
 		if extra:
 			manage_extra_data = ManageCartItemExtraData(product)
 			product = manage_extra_data.add(extra, overwrite=overwrite_extra)
 
+		self._hold_stock(product_id, product["quantity"], current_stock)
 		cart[product_id] = product
 
 		self._set_cart(cart)
+		self._changed("add", product_id, old_product, _copy_item(product))
+
+	def validate_cart(self, get_stock: Optional[StockGetter] = None) -> ValidationResult:
+		"""
+		Validate every line of the cart at once, e.g. before the checkout. The cart is not changed.
+
+		Args:
+			get_stock (Callable, optional): Returns the current stock of a product, None if it is not limited.
+				If a reservation ledger is set, the stock held by other carts is not available.
+
+		Returns:
+			ValidationResult: The normalized quantities of the valid lines, and every violation found.
+		"""
+		cart = self._get_cart()
 
+		return self._get_validator().validate(
+			{product_id: item["quantity"] for product_id, item in cart.items()},
+			self._get_stock_for_cart(get_stock),
+		)
+
+	@_locked
+	def add_many(self,
+              quantities: Mapping[str, Number],
+              get_stock: Optional[StockGetter] = None,
+              overwrite_quantity: bool = False
+              ) -> ValidationResult:
+		"""
+		Add many products to the cart at once, e.g. to reorder a past order or merge two carts.
+		All the quantities are validated first, and the cart is only changed if none of them is rejected;
+		unlike `add`, every violation is returned instead of raising the first error.
+
+		Args:
+			quantities (Mapping[str, Number]): The quantity to add of each product.
+			get_stock (Callable, optional): Returns the current stock of a product, None if it is not limited.
+				If a reservation ledger is set, the stock is held for the cart.
+			overwrite_quantity (bool): If True, the quantities will be overwritten instead of added.
+
+		Returns:
+			ValidationResult: The new quantities of the products, and the violations. If there are violations, the cart is not changed.
+
+		Raises:
+			OutOfStokError: If a reservation ledger is set and the stock is held by another cart in the meantime.
+		"""
+		cart = self._get_cart()
+		current = None if overwrite_quantity else {
+			product_id: cart[product_id]["quantity"] for product_id in quantities if product_id in cart
+		}
+		stocks: dict[str, Optional[Number]] = {}
+
+		def fetch_stock(product_id: str) -> Optional[Number]:
+			stocks[product_id] = get_stock(product_id)  # type: ignore
+			return stocks[product_id]
+
+		result = self._get_validator().validate(
+			quantities, self._get_stock_for_cart(fetch_stock if get_stock is not None else None), current
+		)
+
+		if not result.ok or not result.quantities:
+			return result
+
+		cart = self._get_cart_for_write()
+		quantities_in_cart = {
+			product_id: _to_cart_quantity(quantity) for product_id, quantity in result.quantities.items()
+		}
+		self._hold_stock_many(quantities_in_cart, stocks)
+
+		# The lines are replaced rather than changed in place, so a snapshot sharing them is not altered
+		new_cart = {
+			**cart,
+			**{
+				product_id: {**cart.get(product_id, {}), "quantity": quantity}  # type: ignore
+				for product_id, quantity in quantities_in_cart.items()
+			},
+		}
+		self._set_cart(new_cart)  # type: ignore
+
+		for product_id in quantities_in_cart:
+			self._changed("add", product_id, _copy_item(cart.get(product_id)), _copy_item(new_cart[product_id]))  # type: ignore
+
+		return result
+
+	@_locked
 	def remove(self, product_id: str, silent: bool = True) -> None:
 		"""
 		Removes a product from the cart.
@@ -121,7 +384,7 @@ class FlaskShoppingCart(ShoppingCartBase):
 		Raises:
 			ProductNotFoundError: If the product with the given ID is not found in the cart and silent is False.
 		"""
-		cart = self._get_cart()
+		cart = self._get_cart_for_write()
 
 		if (
 			not product_id in cart
@@ -129,15 +392,28 @@ class FlaskShoppingCart(ShoppingCartBase):
 		):
 			raise ProductNotFoundError("Product not found in the cart.")
 
-		cart.pop(product_id, None)
+		old_product = cart.pop(product_id, None)
+		self._release_stock([product_id])
 		self._set_cart(cart)
 
+		if old_product is not None:
+			self._changed("remove", product_id, old_product, None)
+
+	@_locked
 	def clear(self) -> None:
 		"""
 		Clears the cart.
 		"""
+		cart = self._get_cart()
+		product_ids = list(cart)
+
+		self._release_stock(product_ids)
 		self._set_cart(dict())
 
+		if product_ids:
+			self._changed("clear", None, None, None, cleared=cart)
+
+	@_locked
 	def subtract(self,
               product_id: str,
               quantity: Number = 1,  # type: ignore
@@ -153,7 +429,7 @@ class FlaskShoppingCart(ShoppingCartBase):
 			allow_negative (bool): If True, the quantity can be negative.
 			autoremove_if_0 (bool): If True, the product will be removed if the quantity reaches 0 or less. This flag is only valid if allow_negative is False.
 		"""
-		cart = self._get_cart()
+		cart = self._get_cart_for_write(product_id)
 
 		_allow_negative = allow_negative or self.allow_negative_quantity
 
@@ -162,6 +438,7 @@ class FlaskShoppingCart(ShoppingCartBase):
 
 		else:
 			product = cart[product_id]
+			old_product = _copy_item(product)
 			product["quantity"] -= quantity  # type: ignore
 
 			if (
@@ -186,7 +463,9 @@ class FlaskShoppingCart(ShoppingCartBase):
 						"0 values are not allowed; use the remove method instead or set autoremove_if_0 to True."
 					)
 
+			self._hold_stock(product_id, cart[product_id]["quantity"] if product_id in cart else 0)  # type: ignore
 			self._set_cart(cart)
+			self._changed("subtract", product_id, old_product, _copy_item(cart.get(product_id)))
 
 	def get_product(self, product_id: str) -> CartItem:
 		"""
@@ -220,6 +499,7 @@ class FlaskShoppingCart(ShoppingCartBase):
 		"""
 		return self._get_cart().get(product_id, None)
 
+	@_locked
 	def add_extra_data(self, product_id: str, data: dict, overwrite: bool = False) -> None:
 		"""
 		Add extra data to the cart item.
@@ -234,16 +514,19 @@ class FlaskShoppingCart(ShoppingCartBase):
 			TypeError: If the provided data is not a dictionary.
 			ProductNotFoundError: If the specified product_id is not found in the cart.
 		"""
-		cart = self._get_cart()
+		cart = self._get_cart_for_write(product_id)
 
 		if product_id not in cart:
 			raise ProductNotFoundError()
 
+		old_product = _copy_item(cart[product_id])
 		manage_extra = ManageCartItemExtraData(cart[product_id])
 		cart[product_id] = manage_extra.add(data, overwrite=overwrite)
 
 		self._set_cart(cart)
+		self._changed("add_extra_data", product_id, old_product, _copy_item(cart[product_id]))
 
+	@_locked
 	def remove_extra_data(self, product_id: str, key: str, silent: bool = True) -> None:
 		"""
 		Remove extra data associated with a specific product in the cart.
@@ -257,15 +540,17 @@ class FlaskShoppingCart(ShoppingCartBase):
 			ProductNotFoundError: If the specified product_id is not found in the cart.
 			ProductExtraDataNotFoundError: If the key does not exist in the product's extra data and silent is False.
 		"""
-		cart = self._get_cart()
+		cart = self._get_cart_for_write(product_id)
 
 		if product_id not in cart:
 			raise ProductNotFoundError()
 
+		old_product = _copy_item(cart[product_id])
 		manage_extra = ManageCartItemExtraData(cart[product_id])
 		cart[product_id] = manage_extra.remove(key, silent=silent)
 
 		self._set_cart(cart)
+		self._changed("remove_extra_data", product_id, old_product, _copy_item(cart[product_id]))
 
 	def get_extra_data(self, product_id: str, key: Optional[str] = None) -> Union[Any, dict, None]:
 		"""
@@ -294,6 +579,7 @@ class FlaskShoppingCart(ShoppingCartBase):
 		manage_extra = ManageCartItemExtraData(cart[product_id])
 		return manage_extra.get(key)
 
+	@_locked
 	def clear_extra_data(self, product_id: str) -> None:
 		"""
 		Removes any extra data associated with a specific product in the shopping cart.
@@ -304,12 +590,14 @@ class FlaskShoppingCart(ShoppingCartBase):
 		Raises:
 			ProductNotFoundError: If the specified product_id does not exist in the cart.
 		"""
-		cart = self._get_cart()
+		cart = self._get_cart_for_write(product_id)
 
 		if product_id not in cart:
 			raise ProductNotFoundError()
 
+		old_product = _copy_item(cart[product_id])
 		manage_extra = ManageCartItemExtraData(cart[product_id])
 		cart[product_id] = manage_extra.clear()
 
 		self._set_cart(cart)
+		self._changed("clear_extra_data", product_id, old_product, _copy_item(cart[product_id]))
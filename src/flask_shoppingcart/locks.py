@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+	import fcntl
+except ImportError:  # pragma: no cover
+	fcntl = None  # type: ignore
+
+from .exceptions import CartLockTimeoutError
+
+
+class LockMetrics:
+	"""
+	Counters of the lock acquisitions of a `CartLock`.
+	"""
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self.reset()
+
+	def reset(self) -> None:
+		"""
+		Reset all the counters to 0.
+		"""
+		with self._lock:
+			self.acquisitions: int = 0
+			self.contentions: int = 0
+			self.timeouts: int = 0
+			self.wait_time: float = 0.0
+			self.max_wait_time: float = 0.0
+
+	def record(self, wait_time: float, contended: bool, acquired: bool) -> None:
+		"""
+		Record a lock acquisition attempt.
+
+		Args:
+			wait_time (float): Seconds waited for the lock.
+			contended (bool): True if the lock was held by someone else when it was requested.
+			acquired (bool): False if the attempt timed out.
+		"""
+		with self._lock:
+			if acquired:
+				self.acquisitions += 1
+			else:
+				self.timeouts += 1
+
+			self.contentions += contended
+			self.wait_time += wait_time
+			self.max_wait_time = max(self.max_wait_time, wait_time)
+
+	def as_dict(self) -> dict:
+		"""
+		Get the counters as a dictionary.
+
+		Returns:
+			dict: The counters, along with the average wait time of the acquisitions.
+		"""
+		with self._lock:
+			attempts = self.acquisitions + self.timeouts
+
+			return {
+				"acquisitions": self.acquisitions,
+				"contentions": self.contentions,
+				"timeouts": self.timeouts,
+				"wait_time": self.wait_time,
+				"max_wait_time": self.max_wait_time,
+				"avg_wait_time": self.wait_time / attempts if attempts else 0.0,
+			}
+
+
+class CartLock:
+	"""
+	Base class for the locks that serialize the changes of one cart.
+	Locks are keyed by cart ID, so different carts are not serialized behind a single lock.
+	"""
+
+	#: True if the lock does not serialize anything, so the cart ID is not needed to acquire it.
+	noop: bool = False
+
+	def __init__(self) -> None:
+		self.metrics = LockMetrics()
+
+	@contextmanager
+	def lock(self, cart_id: str, timeout: Optional[float] = None) -> Iterator[None]:
+		"""
+		Hold the lock of a cart while the context is active.
+
+		Args:
+			cart_id (str): The ID of the cart to lock.
+			timeout (float, optional): Seconds to wait for the lock. If None, it waits forever.
+
+		Raises:
+			CartLockTimeoutError: If the lock could not be acquired before the timeout.
+		"""
+		start = time.perf_counter()
+		contended = not self._acquire(cart_id, 0)
+		acquired = not contended or self._acquire(cart_id, timeout)
+		self.metrics.record(time.perf_counter() - start, contended, acquired)
+
+		if not acquired:
+			raise CartLockTimeoutError(f"Timed out waiting for the lock of the cart {cart_id}.")
+
+		try:
+			yield
+
+		finally:
+			self._release(cart_id)
+
+	def _acquire(self, cart_id: str, timeout: Optional[float]) -> bool:
+		"""
+		Acquire the lock of a cart.
+
+		Args:
+			cart_id (str): The ID of the cart to lock.
+			timeout (float, optional): Seconds to wait for the lock. 0 does not wait, None waits forever.
+
+		Returns:
+			bool: True if the lock was acquired.
+		"""
+		raise NotImplementedError
+
+	def _release(self, cart_id: str) -> None:
+		"""
+		Release the lock of a cart.
+
+		Args:
+			cart_id (str): The ID of the locked cart.
+		"""
+		raise NotImplementedError
+
+
+class NullCartLock(CartLock):
+	"""
+	Lock that does nothing. It is the default, as with the cookie-only storage each request works on its own copy of the cart.
+	"""
+
+	noop = True
+
+	def _acquire(self, cart_id: str, timeout: Optional[float]) -> bool:
+		return True
+
+	def _release(self, cart_id: str) -> None:
+		pass
+
+
+class StripedCartLock(CartLock):
+	"""
+	In-process lock for the threads of a worker.
+	The carts are spread over a fixed number of reentrant locks (stripes) by the hash of their ID.
+	"""
+
+	def __init__(self, stripes: int = 64) -> None:
+		"""
+		Args:
+			stripes (int): The number of locks. Carts whose ID falls in the same stripe are serialized with each other.
+		"""
+		super().__init__()
+
+		if stripes < 1:
+			raise ValueError("The number of stripes must be greater than 0.")
+
+		self.stripes = stripes
+		self._locks = [threading.RLock() for _ in range(stripes)]
+
+	def _stripe(self, cart_id: str) -> int:
+		# crc32 is stable between processes, unlike hash() for strings
+		return zlib.crc32(cart_id.encode()) % self.stripes
+
+	def _acquire(self, cart_id: str, timeout: Optional[float]) -> bool:
+		lock = self._locks[self._stripe(cart_id)]
+
+		if timeout is None:
+			return lock.acquire()
+
+		return lock.acquire(timeout=timeout) if timeout > 0 else lock.acquire(blocking=False)
+
+	def _release(self, cart_id: str) -> None:
+		self._locks[self._stripe(cart_id)].release()
+
+
+class FileCartLock(StripedCartLock):
+	"""
+	Lock shared by the threads and the processes of a host, based on advisory locks (`flock`) over one file per stripe.
+	Only available on POSIX systems.
+	"""
+
+	def __init__(self, directory: str, stripes: int = 64, poll_interval: float = 0.005) -> None:
+		"""
+		Args:
+			directory (str): The directory of the lock files. It is created if it does not exist.
+			stripes (int): The number of lock files.
+			poll_interval (float): Seconds between the attempts to lock a file held by another process.
+		"""
+		if fcntl is None:
+			raise RuntimeError("FileCartLock requires fcntl, which is not available on this platform.")
+
+		super().__init__(stripes)
+		os.makedirs(directory, exist_ok=True)
+
+		self.directory = directory
+		self.poll_interval = poll_interval
+		self._pid = os.getpid()
+		self._files: dict[int, int] = {}
+		self._depths = [0] * stripes
+
+	def _file(self, stripe: int) -> int:
+		if self._pid != os.getpid():
+			# Forked: the inherited descriptors share their locks with the parent process
+			self._pid = os.getpid()
+			self._files = {}
+			self._depths = [0] * self.stripes
+
+		fd = self._files.get(stripe)
+
+		if fd is None:
+			fd = self._files[stripe] = os.open(os.path.join(self.directory, f"cart-{stripe}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+
+		return fd
+
+	def _acquire(self, cart_id: str, timeout: Optional[float]) -> bool:
+		deadline = None if timeout is None else time.monotonic() + timeout
+
+		if not super()._acquire(cart_id, timeout):
+			return False
+
+		stripe = self._stripe(cart_id)
+
+		if self._depths[stripe]:
+			self._depths[stripe] += 1
+			return True
+
+		fd = self._file(stripe)
+
+		while True:
+			try:
+				fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)  # type: ignore
+				break
+
+			except BlockingIOError:
+				if deadline is not None and time.monotonic() >= deadline:
+					super()._release(cart_id)
+					return False
+
+				time.sleep(self.poll_interval)
+
+		self._depths[stripe] = 1
+		return True
+
+	def _release(self, cart_id: str) -> None:
+		stripe = self._stripe(cart_id)
+		self._depths[stripe] -= 1
+
+		if not self._depths[stripe]:
+			fcntl.flock(self._file(stripe), fcntl.LOCK_UN)  # type: ignore
+
+		super()._release(cart_id)
@@ -0,0 +1,77 @@
+import copy
+from typing import Callable
+
+from .exceptions import CartSchemaError
+from .models import CartItem
+
+#: The schema version of the carts stored before the carts had one.
+LEGACY_SCHEMA_VERSION = 1
+
+Upgrade = Callable[[dict[str, CartItem]], dict[str, CartItem]]
+
+
+class CartMigrations:
+	"""
+	Versioned cart schemas, with the functions that upgrade a cart from each version to the next one.
+
+	The carts are upgraded lazily, the first time an old cart is read, and the upgraded cart is only written back
+	when the cart is changed. Carts already at the current version are returned without any check.
+	"""
+
+	def __init__(self, version: int = LEGACY_SCHEMA_VERSION) -> None:
+		"""
+		Args:
+			version (int): The current schema version. Carts without a version are at version 1.
+		"""
+		self.version = version
+		self._upgrades: dict[int, Upgrade] = {}
+
+	def register(self, from_version: int) -> Callable[[Upgrade], Upgrade]:
+		"""
+		Register the function that upgrades a cart from `from_version` to `from_version + 1`.
+		The function receives a copy of the cart, and returns the upgraded cart.
+
+		Usage:
+			@migrations.register(1)
+			def rename_colour(cart):
+				...
+				return cart
+		"""
+		def decorator(upgrade: Upgrade) -> Upgrade:
+			if from_version in self._upgrades:
+				raise ValueError(f"An upgrade from the version {from_version} is already registered.")
+
+			self._upgrades[from_version] = upgrade
+			return upgrade
+
+		return decorator
+
+	def upgrade(self, cart: dict[str, CartItem], version: int) -> dict[str, CartItem]:
+		"""
+		Upgrade a cart to the current version. The given cart is not changed.
+
+		Args:
+			cart (dict): The cart data.
+			version (int): The schema version of the cart.
+
+		Returns:
+			dict: The upgraded cart.
+
+		Raises:
+			CartSchemaError: If the cart is newer than the current version, or an upgrade is missing.
+		"""
+		if version > self.version:
+			raise CartSchemaError(f"The cart schema version {version} is newer than the current version {self.version}.")
+
+		cart = copy.deepcopy(cart)
+
+		while version < self.version:
+			upgrade = self._upgrades.get(version)
+
+			if upgrade is None:
+				raise CartSchemaError(f"No upgrade is registered from the cart schema version {version}.")
+
+			cart = upgrade(cart)
+			version += 1
+
+		return cart
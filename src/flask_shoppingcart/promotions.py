@@ -0,0 +1,339 @@
+import threading
+from collections import OrderedDict
+from numbers import Number
+from typing import Any, Callable, Iterable, Mapping, NamedTuple, Optional
+
+from .models import CartItem
+
+PriceGetter = Callable[[str, CartItem], Number]
+
+
+def get_extra_price(product_id: str, item: CartItem) -> Number:
+	"""
+	Default price getter of the `PromotionEngine`: the `price` key of the item's extra data, 0 if it is not set.
+	"""
+	return (item.get("extra") or {}).get("price", 0)
+
+
+class Discount(NamedTuple):
+	"""
+	A discount applied to the cart by a rule.
+	"""
+	name: str
+	amount: Number
+	product_ids: tuple
+
+
+class Rule:
+	"""
+	Base class for the promotion rules.
+
+	A rule applies to the cart lines that match all its conditions:
+	- `product_ids`: the line's product ID is one of them.
+	- `extra`: the line's extra data has all these key/value pairs.
+
+	Line rules compute a discount per line, so when a line changes only that line is computed again.
+	Rules that depend on the whole cart set `per_line` to False and implement `cart_discount()` instead.
+	"""
+
+	per_line: bool = True
+
+	def __init__(self, name: str, product_ids: Optional[Iterable[str]] = None, extra: Optional[Mapping[str, Any]] = None) -> None:
+		self.name = name
+		self.product_ids = frozenset(product_ids) if product_ids is not None else None
+		self.extra = dict(extra or {})
+
+	def matches(self, product_id: str, item: CartItem) -> bool:
+		"""
+		Check if the rule applies to a cart line.
+
+		Returns:
+			bool: True if the line matches all the conditions of the rule.
+		"""
+		if self.product_ids is not None and product_id not in self.product_ids:
+			return False
+
+		if self.extra:
+			extra = item.get("extra") or {}
+			return all(key in extra and extra[key] == value for key, value in self.extra.items())
+
+		return True
+
+	def line_discount(self, product_id: str, item: CartItem, price: Number) -> Number:
+		"""
+		Compute the discount of a matching line.
+
+		Args:
+			product_id (str): The ID of the product of the line.
+			item (CartItem): The cart line.
+			price (Number): The unit price of the product.
+
+		Returns:
+			Number: The discount amount, 0 if none.
+		"""
+		raise NotImplementedError
+
+	def cart_discount(self, cart: Mapping[str, CartItem], get_price: PriceGetter) -> tuple[Number, tuple]:
+		"""
+		Compute the discount of a rule that depends on the whole cart.
+
+		Returns:
+			tuple: The discount amount and the IDs of the discounted products.
+		"""
+		raise NotImplementedError
+
+
+class BuyXGetY(Rule):
+	"""
+	For every `buy` units of a product, `get` more units are free. E.g. `BuyXGetY("3x4", buy=3, get=1)`.
+	"""
+
+	def __init__(self, name: str, buy: int, get: int = 1, product_ids: Optional[Iterable[str]] = None, extra: Optional[Mapping[str, Any]] = None) -> None:
+		super().__init__(name, product_ids, extra)
+
+		if buy < 1 or get < 1:
+			raise ValueError("buy and get must be greater than 0.")
+
+		self.buy = buy
+		self.get = get
+
+	def line_discount(self, product_id: str, item: CartItem, price: Number) -> Number:
+		return int(item["quantity"] // (self.buy + self.get)) * self.get * price  # type: ignore
+
+
+class PercentOff(Rule):
+	"""
+	A percentage off the price of the matching lines. E.g. `PercentOff("shoes-10", 10, extra={"category": "shoes"})`.
+	"""
+
+	def __init__(self, name: str, percent: Number, product_ids: Optional[Iterable[str]] = None, extra: Optional[Mapping[str, Any]] = None) -> None:
+		super().__init__(name, product_ids, extra)
+		self.percent = percent
+
+	def line_discount(self, product_id: str, item: CartItem, price: Number) -> Number:
+		return price * item["quantity"] * self.percent / 100  # type: ignore
+
+
+class FreeItemOver(Rule):
+	"""
+	One unit of a product is free when the subtotal of the rest of the cart reaches a threshold.
+	The gift must be in the cart to be discounted.
+	"""
+
+	per_line = False
+
+	def __init__(self, name: str, threshold: Number, product_id: str) -> None:
+		super().__init__(name)
+		self.threshold = threshold
+		self.product_id = product_id
+
+	def cart_discount(self, cart: Mapping[str, CartItem], get_price: PriceGetter) -> tuple[Number, tuple]:
+		gift = cart.get(self.product_id)
+
+		if gift is None or gift["quantity"] <= 0:  # type: ignore
+			return 0, ()
+
+		subtotal = sum(
+			get_price(product_id, item) * item["quantity"]  # type: ignore
+			for product_id, item in cart.items()
+			if product_id != self.product_id
+		)
+
+		if subtotal < self.threshold:  # type: ignore
+			return 0, ()
+
+		return get_price(self.product_id, gift), (self.product_id,)
+
+
+class _CartDiscounts:
+	"""
+	Cached discounts of a cart at a given version.
+	"""
+
+	def __init__(self, version: Optional[str]) -> None:
+		self.version = version
+		self.lines: dict[int, dict[str, Number]] = {}
+		self.carts: dict[int, tuple[Number, tuple]] = {}
+		self.dirty_lines: set[tuple[int, str]] = set()
+		self.dirty_carts: set[int] = set()
+		self.discounts: Optional[list[Discount]] = None
+
+
+class PromotionEngine:
+	"""
+	Evaluates a set of promotion rules over the carts.
+
+	The rules are compiled once into an index by product ID and extra data attribute, so a change of a line
+	only marks the rules that may apply to it. The discounts of each cart are cached in memory by cart ID and version,
+	and only the marked rules are computed again; a cart whose version is unknown, e.g. because it was changed
+	by another process, is computed from scratch.
+	"""
+
+	def __init__(self, rules: Iterable[Rule], get_price: PriceGetter = get_extra_price, max_carts: int = 10000) -> None:
+		"""
+		Args:
+			rules (Iterable[Rule]): The promotion rules.
+			get_price (Callable): Returns the unit price of a cart line. Defaults to the `price` key of the extra data.
+			max_carts (int): The maximum number of carts whose discounts are cached. The least recently used are dropped.
+		"""
+		self.rules = list(rules)
+		self.get_price = get_price
+		self.max_carts = max_carts
+		self._lock = threading.Lock()
+		self._carts: OrderedDict[str, _CartDiscounts] = OrderedDict()
+		self._compile()
+
+	def _compile(self) -> None:
+		self._by_product: dict[str, list[int]] = {}
+		self._by_attribute: dict[tuple[str, Any], list[int]] = {}
+		self._every_line: list[int] = []
+		self._per_cart: list[int] = []
+
+		for index, rule in enumerate(self.rules):
+			if not rule.per_line:
+				self._per_cart.append(index)
+
+			elif rule.product_ids is not None:
+				for product_id in rule.product_ids:
+					self._by_product.setdefault(product_id, []).append(index)
+
+			elif rule.extra:
+				# Indexing by one of the attributes is enough, matches() checks the rest
+				self._by_attribute.setdefault(next(iter(rule.extra.items())), []).append(index)
+
+			else:
+				self._every_line.append(index)
+
+	def _line_rules(self, product_id: str, item: Optional[CartItem]) -> set[int]:
+		rules = set(self._every_line)
+		rules.update(self._by_product.get(product_id, ()))
+
+		for attribute in ((item or {}).get("extra") or {}).items():
+			try:
+				rules.update(self._by_attribute.get(attribute, ()))
+
+			except TypeError:
+				# Unhashable values cannot be indexed, and rules only match hashable ones
+				continue
+
+		return rules
+
+	def notify(self, cart_id: str, old_version: Optional[str], version: str,
+	           product_id: Optional[str], old: Optional[CartItem], new: Optional[CartItem]) -> None:
+		"""
+		Mark the rules affected by a change of a cart line.
+
+		Args:
+			cart_id (str): The ID of the cart.
+			old_version (str, optional): The version of the cart before the change.
+			version (str): The version of the cart after the change.
+			product_id (str, optional): The ID of the changed product. None if the cart was cleared.
+			old (CartItem, optional): The line before the change. None if it was added.
+			new (CartItem, optional): The line after the change. None if it was removed.
+		"""
+		with self._lock:
+			state = self._carts.get(cart_id)
+
+			if product_id is None:
+				self._store(cart_id, _CartDiscounts(version))
+				return
+
+			if state is None or state.version != old_version:
+				self._carts.pop(cart_id, None)
+				return
+
+			state.version = version
+			state.discounts = None
+			state.dirty_carts.update(self._per_cart)
+
+			for index in self._line_rules(product_id, old) | self._line_rules(product_id, new):
+				state.dirty_lines.add((index, product_id))
+
+	def _store(self, cart_id: str, state: _CartDiscounts) -> None:
+		self._carts[cart_id] = state
+		self._carts.move_to_end(cart_id)
+
+		while len(self._carts) > self.max_carts:
+			self._carts.popitem(last=False)
+
+	def _evaluate_line(self, state: _CartDiscounts, index: int, product_id: str, item: Optional[CartItem]) -> None:
+		rule = self.rules[index]
+		lines = state.lines.setdefault(index, {})
+
+		amount = rule.line_discount(product_id, item, self.get_price(product_id, item)) if (
+			item is not None and rule.matches(product_id, item)
+		) else 0
+
+		if amount:
+			lines[product_id] = amount
+		else:
+			lines.pop(product_id, None)
+
+	def _evaluate_all(self, state: _CartDiscounts, cart: Mapping[str, CartItem]) -> None:
+		for product_id, item in cart.items():
+			for index in self._line_rules(product_id, item):
+				self._evaluate_line(state, index, product_id, item)
+
+		state.dirty_carts.update(self._per_cart)
+
+	def evaluate(self, cart_id: str, version: Optional[str], cart: Mapping[str, CartItem]) -> list[Discount]:
+		"""
+		Get the discounts applied to a cart.
+
+		Args:
+			cart_id (str): The ID of the cart.
+			version (str, optional): The current version of the cart.
+			cart (Mapping[str, CartItem]): The cart data.
+
+		Returns:
+			list[Discount]: The applied discounts, in the order of the rules.
+		"""
+		with self._lock:
+			state = self._carts.get(cart_id)
+
+			if state is None or state.version != version:
+				state = _CartDiscounts(version)
+				self._evaluate_all(state, cart)
+
+			if state.discounts is None or state.dirty_lines or state.dirty_carts:
+				for index, product_id in state.dirty_lines:
+					self._evaluate_line(state, index, product_id, cart.get(product_id))
+
+				for index in state.dirty_carts:
+					state.carts[index] = self.rules[index].cart_discount(cart, self.get_price)
+
+				state.dirty_lines.clear()
+				state.dirty_carts.clear()
+				state.discounts = self._collect(state)
+
+			self._store(cart_id, state)
+			return list(state.discounts)
+
+	def _collect(self, state: _CartDiscounts) -> list[Discount]:
+		discounts: list[Discount] = []
+
+		for index, rule in enumerate(self.rules):
+			if rule.per_line:
+				lines = state.lines.get(index)
+
+				if lines:
+					discounts.append(Discount(rule.name, sum(lines.values()), tuple(lines)))  # type: ignore
+
+			else:
+				amount, product_ids = state.carts.get(index, (0, ()))
+
+				if amount:
+					discounts.append(Discount(rule.name, amount, product_ids))
+
+		return discounts
+
+	def invalidate(self, cart_id: Optional[str] = None) -> None:
+		"""
+		Drop the cached discounts of a cart, or of every cart if no ID is provided.
+		"""
+		with self._lock:
+			if cart_id is None:
+				self._carts.clear()
+			else:
+				self._carts.pop(cart_id, None)
+
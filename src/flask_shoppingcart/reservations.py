@@ -0,0 +1,357 @@
+import heapq
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from numbers import Number
+from typing import Callable, Iterable, Iterator, Optional
+
+from .exceptions import OutOfStokError
+
+
+class ReservationLedger:
+	"""
+	Base class for the stock reservation ledgers.
+
+	A ledger keeps time-limited holds of a product's stock for a holder (the cart ID).
+	The total of the active holds of every product is kept as an aggregate that is updated on each change,
+	so the available stock is computed without summing the holds. Expired holds are released lazily,
+	the next time the product is touched.
+	"""
+
+	def reserve(self, product_id: str, holder_id: str, quantity: Number, stock: Number, ttl: float) -> None:
+		"""
+		Create or replace the hold of a holder over a product.
+
+		Args:
+			product_id (str): The ID of the product to hold.
+			holder_id (str): The ID of the holder (usually the cart ID).
+			quantity (Number): The total quantity to hold. It replaces the quantity of any existing hold.
+			stock (Number): The current stock of the product.
+			ttl (float): Seconds until the hold expires.
+
+		Raises:
+			OutOfStokError: If the quantity exceeds the stock not held by other holders.
+		"""
+		raise NotImplementedError
+
+	def adjust(self, product_id: str, holder_id: str, quantity: Number, ttl: float) -> None:
+		"""
+		Update the quantity of an existing hold and renew its expiration, without validating the stock.
+		If the holder has no hold over the product, nothing is done. A quantity of 0 or less releases the hold.
+
+		Args:
+			product_id (str): The ID of the held product.
+			holder_id (str): The ID of the holder.
+			quantity (Number): The new quantity of the hold.
+			ttl (float): Seconds until the hold expires.
+		"""
+		raise NotImplementedError
+
+	def release(self, product_id: str, holder_id: str) -> None:
+		"""
+		Release the hold of a holder over a product, if any.
+
+		Args:
+			product_id (str): The ID of the held product.
+			holder_id (str): The ID of the holder.
+		"""
+		raise NotImplementedError
+
+	def release_all(self, holder_id: str, product_ids: Iterable[str]) -> None:
+		"""
+		Release the holds of a holder over the given products.
+
+		Args:
+			holder_id (str): The ID of the holder.
+			product_ids (Iterable[str]): The IDs of the held products.
+		"""
+		for product_id in product_ids:
+			self.release(product_id, holder_id)
+
+	def get_hold(self, product_id: str, holder_id: str) -> Number:
+		"""
+		Get the quantity held by a holder over a product.
+
+		Returns:
+			Number: The held quantity, 0 if the holder has no active hold.
+		"""
+		raise NotImplementedError
+
+	def held(self, product_id: str) -> Number:
+		"""
+		Get the total quantity of a product held by active holds.
+
+		Returns:
+			Number: The held quantity.
+		"""
+		raise NotImplementedError
+
+	def available(self, product_id: str, stock: Number) -> Number:
+		"""
+		Get the stock of a product that is not held by active holds.
+
+		Args:
+			product_id (str): The ID of the product.
+			stock (Number): The current stock of the product.
+
+		Returns:
+			Number: The available stock.
+		"""
+		return stock - self.held(product_id)  # type: ignore
+
+
+class MemoryReservationLedger(ReservationLedger):
+	"""
+	In-process reservation ledger. It is shared by the threads of a worker but not across processes.
+	"""
+
+	def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+		self._clock = clock
+		self._lock = threading.Lock()
+		self._holds: dict[str, dict[str, tuple[Number, float]]] = {}
+		self._held: dict[str, Number] = {}
+		# Per product min-heap of (expires_at, holder_id). Entries of holds that were renewed or released are skipped on purge.
+		self._expirations: dict[str, list[tuple[float, str]]] = {}
+
+	def _purge(self, product_id: str, now: float) -> None:
+		heap = self._expirations.get(product_id)
+
+		while heap and heap[0][0] <= now:
+			expires_at, holder_id = heapq.heappop(heap)
+			hold = self._holds[product_id].get(holder_id)
+
+			if hold is not None and hold[1] == expires_at:
+				self._drop(product_id, holder_id)
+
+	def _drop(self, product_id: str, holder_id: str) -> None:
+		holds = self._holds[product_id]
+		quantity, _ = holds.pop(holder_id)
+		self._held[product_id] -= quantity  # type: ignore
+
+		if not holds:
+			del self._holds[product_id]
+			del self._held[product_id]
+			del self._expirations[product_id]
+
+	def _set(self, product_id: str, holder_id: str, quantity: Number, expires_at: float) -> None:
+		holds = self._holds.setdefault(product_id, {})
+		previous, _ = holds.get(holder_id, (0, 0.0))
+
+		holds[holder_id] = (quantity, expires_at)
+		self._held[product_id] = self._held.get(product_id, 0) - previous + quantity  # type: ignore
+		heapq.heappush(self._expirations.setdefault(product_id, []), (expires_at, holder_id))
+
+	def reserve(self, product_id: str, holder_id: str, quantity: Number, stock: Number, ttl: float) -> None:
+		with self._lock:
+			now = self._clock()
+			self._purge(product_id, now)
+
+			own, _ = self._holds.get(product_id, {}).get(holder_id, (0, 0.0))
+			held_by_others = self._held.get(product_id, 0) - own  # type: ignore
+
+			if quantity > stock - held_by_others:  # type: ignore
+				raise OutOfStokError()
+
+			if quantity <= 0:  # type: ignore
+				if own:
+					self._drop(product_id, holder_id)
+				return
+
+			self._set(product_id, holder_id, quantity, now + ttl)
+
+	def adjust(self, product_id: str, holder_id: str, quantity: Number, ttl: float) -> None:
+		with self._lock:
+			now = self._clock()
+			self._purge(product_id, now)
+
+			if holder_id not in self._holds.get(product_id, {}):
+				return
+
+			if quantity <= 0:  # type: ignore
+				self._drop(product_id, holder_id)
+			else:
+				self._set(product_id, holder_id, quantity, now + ttl)
+
+	def release(self, product_id: str, holder_id: str) -> None:
+		with self._lock:
+			if holder_id in self._holds.get(product_id, {}):
+				self._drop(product_id, holder_id)
+
+	def get_hold(self, product_id: str, holder_id: str) -> Number:
+		with self._lock:
+			self._purge(product_id, self._clock())
+			return self._holds.get(product_id, {}).get(holder_id, (0, 0.0))[0]
+
+	def held(self, product_id: str) -> Number:
+		with self._lock:
+			self._purge(product_id, self._clock())
+			return self._held.get(product_id, 0)  # type: ignore
+
+
+class SQLiteReservationLedger(ReservationLedger):
+	"""
+	Reservation ledger stored in a SQLite database file, so it can be shared by several worker processes.
+	Every change runs in an immediate transaction, which serializes the writers of the database. The reads do not
+	take the write lock: they skip the expired holds instead of purging them, and with the WAL journal they are not
+	blocked by the writers either.
+
+	Quantities are stored as SQLite numbers, so `Decimal` quantities are stored as floats.
+	"""
+
+	def __init__(self, path: str, timeout: float = 5.0, clock: Callable[[], float] = time.time) -> None:
+		"""
+		Args:
+			path (str): The path of the database file. In-memory databases are not supported, as each thread opens its own connection.
+			timeout (float): Seconds to wait for the database lock before failing.
+			clock (Callable): The wall clock used for the expirations. It must be shared by all the processes.
+		"""
+		self.path = path
+		self.timeout = timeout
+		self._clock = clock
+		self._local = threading.local()
+
+		with self._transaction() as connection:
+			connection.execute(
+				"CREATE TABLE IF NOT EXISTS holds ("
+				"product_id TEXT NOT NULL, holder_id TEXT NOT NULL, quantity NUMERIC NOT NULL, expires_at REAL NOT NULL, "
+				"PRIMARY KEY (product_id, holder_id))"
+			)
+			connection.execute("CREATE INDEX IF NOT EXISTS holds_expiration ON holds (product_id, expires_at)")
+			connection.execute("CREATE TABLE IF NOT EXISTS held (product_id TEXT PRIMARY KEY, quantity NUMERIC NOT NULL)")
+
+	@property
+	def _connection(self) -> sqlite3.Connection:
+		connection = getattr(self._local, "connection", None)
+
+		if connection is None:
+			connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+			connection.execute("PRAGMA journal_mode=WAL")
+			self._local.connection = connection
+
+		return connection
+
+	@contextmanager
+	def _transaction(self) -> Iterator[sqlite3.Connection]:
+		connection = self._connection
+		connection.execute("BEGIN IMMEDIATE")
+
+		try:
+			yield connection
+
+		except BaseException:
+			connection.execute("ROLLBACK")
+			raise
+
+		else:
+			connection.execute("COMMIT")
+
+	@staticmethod
+	def _to_sql(quantity: Number) -> Number:
+		return float(quantity) if isinstance(quantity, Decimal) else quantity
+
+	def _purge(self, connection: sqlite3.Connection, product_id: str, now: float) -> None:
+		expired = connection.execute(
+			"SELECT SUM(quantity) FROM holds WHERE product_id = ? AND expires_at <= ?", (product_id, now)
+		).fetchone()[0]
+
+		if expired is not None:
+			connection.execute("DELETE FROM holds WHERE product_id = ? AND expires_at <= ?", (product_id, now))
+			self._add_held(connection, product_id, -expired)
+
+	def _add_held(self, connection: sqlite3.Connection, product_id: str, delta: Number) -> None:
+		connection.execute(
+			"INSERT INTO held (product_id, quantity) VALUES (?, ?) "
+			"ON CONFLICT (product_id) DO UPDATE SET quantity = quantity + excluded.quantity",
+			(product_id, delta)
+		)
+		connection.execute("DELETE FROM held WHERE product_id = ? AND quantity = 0", (product_id,))
+
+	def _get_own(self, connection: sqlite3.Connection, product_id: str, holder_id: str) -> Optional[Number]:
+		row = connection.execute(
+			"SELECT quantity FROM holds WHERE product_id = ? AND holder_id = ?", (product_id, holder_id)
+		).fetchone()
+		return row[0] if row else None
+
+	def _get_held(self, connection: sqlite3.Connection, product_id: str) -> Number:
+		row = connection.execute("SELECT quantity FROM held WHERE product_id = ?", (product_id,)).fetchone()
+		return row[0] if row else 0
+
+	def _set(self, connection: sqlite3.Connection, product_id: str, holder_id: str, quantity: Number, own: Optional[Number], expires_at: float) -> None:
+		connection.execute(
+			"INSERT OR REPLACE INTO holds (product_id, holder_id, quantity, expires_at) VALUES (?, ?, ?, ?)",
+			(product_id, holder_id, quantity, expires_at)
+		)
+		self._add_held(connection, product_id, quantity - (own or 0))  # type: ignore
+
+	def _drop(self, connection: sqlite3.Connection, product_id: str, holder_id: str, own: Number) -> None:
+		connection.execute("DELETE FROM holds WHERE product_id = ? AND holder_id = ?", (product_id, holder_id))
+		self._add_held(connection, product_id, -own)  # type: ignore
+
+	def reserve(self, product_id: str, holder_id: str, quantity: Number, stock: Number, ttl: float) -> None:
+		quantity = self._to_sql(quantity)
+
+		with self._transaction() as connection:
+			now = self._clock()
+			self._purge(connection, product_id, now)
+
+			own = self._get_own(connection, product_id, holder_id)
+			held_by_others = self._get_held(connection, product_id) - (own or 0)  # type: ignore
+
+			if quantity > self._to_sql(stock) - held_by_others:  # type: ignore
+				raise OutOfStokError()
+
+			if quantity <= 0:  # type: ignore
+				if own is not None:
+					self._drop(connection, product_id, holder_id, own)
+				return
+
+			self._set(connection, product_id, holder_id, quantity, own, now + ttl)
+
+	def adjust(self, product_id: str, holder_id: str, quantity: Number, ttl: float) -> None:
+		quantity = self._to_sql(quantity)
+
+		with self._transaction() as connection:
+			now = self._clock()
+			self._purge(connection, product_id, now)
+
+			own = self._get_own(connection, product_id, holder_id)
+
+			if own is None:
+				return
+
+			if quantity <= 0:  # type: ignore
+				self._drop(connection, product_id, holder_id, own)
+			else:
+				self._set(connection, product_id, holder_id, quantity, own, now + ttl)
+
+	def release(self, product_id: str, holder_id: str) -> None:
+		with self._transaction() as connection:
+			own = self._get_own(connection, product_id, holder_id)
+
+			if own is not None:
+				self._drop(connection, product_id, holder_id, own)
+
+	def release_all(self, holder_id: str, product_ids: Iterable[str]) -> None:
+		with self._transaction() as connection:
+			for product_id in product_ids:
+				own = self._get_own(connection, product_id, holder_id)
+
+				if own is not None:
+					self._drop(connection, product_id, holder_id, own)
+
+	def get_hold(self, product_id: str, holder_id: str) -> Number:
+		row = self._connection.execute(
+			"SELECT quantity FROM holds WHERE product_id = ? AND holder_id = ? AND expires_at > ?",
+			(product_id, holder_id, self._clock())
+		).fetchone()
+		return row[0] if row else 0
+
+	def held(self, product_id: str) -> Number:
+		# A single statement reads a consistent snapshot: the aggregate, less the expired holds not purged yet
+		return self._connection.execute(
+			"SELECT (SELECT COALESCE(SUM(quantity), 0) FROM held WHERE product_id = ?) "
+			"- (SELECT COALESCE(SUM(quantity), 0) FROM holds WHERE product_id = ? AND expires_at <= ?)",
+			(product_id, product_id, self._clock())
+		).fetchone()[0]
@@ -0,0 +1,117 @@
+from collections.abc import Mapping
+from numbers import Number
+from types import MappingProxyType
+from typing import Any, Iterator, Optional
+
+from .models import CartItem
+
+
+class CartLine(Mapping):
+	"""
+	Read-only view of a cart line. It can be read as a mapping (`line["quantity"]`) or by attributes (`line.quantity`).
+	The extra data is returned as a read-only mapping; the values inside it are not copied.
+	"""
+
+	__slots__ = ("_item",)
+
+	def __init__(self, item: CartItem) -> None:
+		self._item = item
+
+	@property
+	def quantity(self) -> Number:
+		return self._item["quantity"]
+
+	@property
+	def extra(self) -> Optional[Mapping]:
+		extra = self._item.get("extra")
+		return MappingProxyType(extra) if extra is not None else None
+
+	def __getitem__(self, key: str) -> Any:
+		if key == "extra":
+			return self.extra
+
+		return self._item[key]  # type: ignore
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self._item)
+
+	def __len__(self) -> int:
+		return len(self._item)
+
+	def __repr__(self) -> str:
+		return f"CartLine({self._item!r})"
+
+	def to_dict(self) -> CartItem:
+		"""
+		Get a mutable copy of the line.
+
+		Returns:
+			CartItem: The line data.
+		"""
+		item: CartItem = dict(self._item)  # type: ignore
+
+		if "extra" in item:
+			item["extra"] = dict(item["extra"])
+
+		return item
+
+
+class CartSnapshot(Mapping):
+	"""
+	Read-only view of the cart at a given version, keyed by product ID.
+
+	Creating a snapshot copies nothing: it wraps the cart data, and the cart copies a line only when it is changed
+	after the snapshot was taken. So the snapshot keeps the state it was taken at, and can be passed to templates,
+	background jobs or the checkout without defensive copies.
+	"""
+
+	__slots__ = ("_cart", "version", "_total_quantity")
+
+	def __init__(self, cart: dict[str, CartItem], version: Optional[str] = None, total_quantity: Optional[Number] = None) -> None:
+		"""
+		Args:
+			cart (dict): The cart data. It must not be changed in place afterwards.
+			version (str, optional): The version of the cart.
+			total_quantity (Number, optional): The total quantity of the cart, if it is already known.
+		"""
+		self._cart = cart
+		self.version = version
+		self._total_quantity = total_quantity
+
+	@property
+	def line_count(self) -> int:
+		"""
+		The number of lines (distinct products) of the cart.
+		"""
+		return len(self._cart)
+
+	@property
+	def total_quantity(self) -> Number:
+		"""
+		The sum of the quantities of all the lines. It is computed once, on first access.
+		"""
+		if self._total_quantity is None:
+			self._total_quantity = sum(item["quantity"] for item in self._cart.values())  # type: ignore
+
+		return self._total_quantity  # type: ignore
+
+	def __getitem__(self, product_id: str) -> CartLine:
+		return CartLine(self._cart[product_id])
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self._cart)
+
+	def __len__(self) -> int:
+		return len(self._cart)
+
+	def __repr__(self) -> str:
+		return f"CartSnapshot({self._cart!r}, version={self.version!r})"
+
+	def to_dict(self) -> dict[str, CartItem]:
+		"""
+		Get a mutable copy of the cart, e.g. to serialize it to JSON.
+
+		Returns:
+			dict: The cart data.
+		"""
+		return {product_id: CartLine(item).to_dict() for product_id, item in self._cart.items()}
@@ -0,0 +1,485 @@
+import bisect
+import copy
+import hashlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, Mapping, Optional
+
+from flask.sessions import session_json_serializer
+
+from .models import CartItem
+
+
+class CartStore:
+	"""
+	Base class for the server-side cart storages, keyed by cart ID.
+	The carts are returned as new dictionaries, so changing them does not change the stored cart until it is set again.
+	"""
+
+	def get(self, cart_id: str) -> Optional[dict[str, CartItem]]:
+		"""
+		Get a cart.
+
+		Returns:
+			dict: The cart data, None if the cart is not stored.
+		"""
+		raise NotImplementedError
+
+	def set(self, cart_id: str, cart: dict[str, CartItem]) -> None:
+		"""
+		Store a cart, replacing the previous one.
+		"""
+		raise NotImplementedError
+
+	def insert(self, cart_id: str, cart: dict[str, CartItem]) -> bool:
+		"""
+		Store a cart only if no cart is stored with the same ID, in a single atomic step,
+		so a cart written meanwhile by another request is never replaced.
+
+		Returns:
+			bool: True if the cart was stored, False if a cart was already stored.
+		"""
+		raise NotImplementedError
+
+	def delete(self, cart_id: str) -> None:
+		"""
+		Delete a cart, if it is stored.
+		"""
+		raise NotImplementedError
+
+	def ids(self) -> list[str]:
+		"""
+		Get the IDs of all the stored carts.
+		"""
+		raise NotImplementedError
+
+	def expire(self, max_age: float) -> int:
+		"""
+		Delete the carts that were not stored again in the last `max_age` seconds.
+
+		Returns:
+			int: The number of deleted carts.
+		"""
+		raise NotImplementedError
+
+	def export(self) -> dict[str, dict[str, CartItem]]:
+		"""
+		Get all the stored carts.
+
+		Returns:
+			dict: The carts by cart ID.
+		"""
+		carts = {}
+
+		for cart_id in self.ids():
+			cart = self.get(cart_id)
+
+			if cart is not None:
+				carts[cart_id] = cart
+
+		return carts
+
+
+class MemoryCartStore(CartStore):
+	"""
+	In-process cart storage. It is shared by the threads of a worker but not across processes.
+	"""
+
+	def __init__(self, clock: Callable[[], float] = time.time) -> None:
+		self._clock = clock
+		self._lock = threading.Lock()
+		self._carts: dict[str, tuple[dict[str, CartItem], float]] = {}
+
+	def get(self, cart_id: str) -> Optional[dict[str, CartItem]]:
+		with self._lock:
+			stored = self._carts.get(cart_id)
+
+		return copy.deepcopy(stored[0]) if stored is not None else None
+
+	def set(self, cart_id: str, cart: dict[str, CartItem]) -> None:
+		cart = copy.deepcopy(cart)
+
+		with self._lock:
+			self._carts[cart_id] = (cart, self._clock())
+
+	def insert(self, cart_id: str, cart: dict[str, CartItem]) -> bool:
+		cart = copy.deepcopy(cart)
+
+		with self._lock:
+			if cart_id in self._carts:
+				return False
+
+			self._carts[cart_id] = (cart, self._clock())
+			return True
+
+	def delete(self, cart_id: str) -> None:
+		with self._lock:
+			self._carts.pop(cart_id, None)
+
+	def ids(self) -> list[str]:
+		with self._lock:
+			return list(self._carts)
+
+	def expire(self, max_age: float) -> int:
+		limit = self._clock() - max_age
+
+		with self._lock:
+			expired = [cart_id for cart_id, (_, updated_at) in self._carts.items() if updated_at < limit]
+
+			for cart_id in expired:
+				del self._carts[cart_id]
+
+		return len(expired)
+
+
+class SQLiteCartStore(CartStore):
+	"""
+	Cart storage in a SQLite database file, so it can be shared by several worker processes.
+	The carts are serialized like the Flask session cookies.
+	"""
+
+	def __init__(self, path: str, timeout: float = 5.0, clock: Callable[[], float] = time.time) -> None:
+		"""
+		Args:
+			path (str): The path of the database file. In-memory databases are not supported, as each thread opens its own connection.
+			timeout (float): Seconds to wait for the database lock before failing.
+			clock (Callable): The wall clock used for the expirations. It must be shared by all the processes.
+		"""
+		self.path = path
+		self.timeout = timeout
+		self._clock = clock
+		self._local = threading.local()
+
+		with self._transaction() as connection:
+			connection.execute("CREATE TABLE IF NOT EXISTS carts (cart_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+			connection.execute("CREATE INDEX IF NOT EXISTS carts_updated_at ON carts (updated_at)")
+
+	@property
+	def _connection(self) -> sqlite3.Connection:
+		connection = getattr(self._local, "connection", None)
+
+		if connection is None:
+			connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+			connection.execute("PRAGMA journal_mode=WAL")
+			self._local.connection = connection
+
+		return connection
+
+	@contextmanager
+	def _transaction(self) -> Iterator[sqlite3.Connection]:
+		connection = self._connection
+		connection.execute("BEGIN IMMEDIATE")
+
+		try:
+			yield connection
+
+		except BaseException:
+			connection.execute("ROLLBACK")
+			raise
+
+		else:
+			connection.execute("COMMIT")
+
+	def get(self, cart_id: str) -> Optional[dict[str, CartItem]]:
+		row = self._connection.execute("SELECT data FROM carts WHERE cart_id = ?", (cart_id,)).fetchone()
+		return session_json_serializer.loads(row[0]) if row else None
+
+	def set(self, cart_id: str, cart: dict[str, CartItem]) -> None:
+		self._connection.execute(
+			"INSERT OR REPLACE INTO carts (cart_id, data, updated_at) VALUES (?, ?, ?)",
+			(cart_id, session_json_serializer.dumps(cart), self._clock())
+		)
+
+	def insert(self, cart_id: str, cart: dict[str, CartItem]) -> bool:
+		return self._connection.execute(
+			"INSERT INTO carts (cart_id, data, updated_at) VALUES (?, ?, ?) ON CONFLICT (cart_id) DO NOTHING",
+			(cart_id, session_json_serializer.dumps(cart), self._clock())
+		).rowcount == 1
+
+	def delete(self, cart_id: str) -> None:
+		self._connection.execute("DELETE FROM carts WHERE cart_id = ?", (cart_id,))
+
+	def ids(self) -> list[str]:
+		return [row[0] for row in self._connection.execute("SELECT cart_id FROM carts")]
+
+	def expire(self, max_age: float) -> int:
+		return self._connection.execute("DELETE FROM carts WHERE updated_at < ?", (self._clock() - max_age,)).rowcount
+
+	def export(self) -> dict[str, dict[str, CartItem]]:
+		return {
+			cart_id: session_json_serializer.loads(data)
+			for cart_id, data in self._connection.execute("SELECT cart_id, data FROM carts")
+		}
+
+
+class ShardMetrics:
+	"""
+	Counters of the operations of a shard.
+	"""
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self.reads = 0
+		self.writes = 0
+		self.deletes = 0
+		self.migrations = 0
+		self.time = 0.0
+
+	def record(self, operation: str, elapsed: float) -> None:
+		with self._lock:
+			setattr(self, operation, getattr(self, operation) + 1)
+			self.time += elapsed
+
+	def as_dict(self) -> dict:
+		with self._lock:
+			return {
+				"reads": self.reads,
+				"writes": self.writes,
+				"deletes": self.deletes,
+				"migrations": self.migrations,
+				"time": self.time,
+			}
+
+
+class ShardedCartStore(CartStore):
+	"""
+	Spreads the carts over several storages (shards) with consistent hashing, so adding or removing a shard
+	only moves the carts of the ring segments it takes or gives.
+
+	When the shards change, the carts are moved to their new shard lazily, the first time they are read or written,
+	or eagerly with `rebalance()`. Bulk operations (`ids()`, `export()` and `expire()`) run on all shards in parallel.
+
+	The ring is built by each process from its arguments, so in a multi-process deployment the shards are changed
+	by restarting the workers with the new `shards` and the old ones as `previous_shards`: every worker then agrees
+	on where each cart lives, and finds the carts not moved yet in their previous shard.
+	"""
+
+	def __init__(self,
+	             shards: Mapping[str, CartStore],
+	             replicas: int = 100,
+	             max_workers: Optional[int] = None,
+	             previous_shards: Optional[Mapping[str, CartStore]] = None
+	             ) -> None:
+		"""
+		Args:
+			shards (Mapping[str, CartStore]): The shards by name. The names, not the order, place the shards in the ring.
+			replicas (int): The number of points of each shard in the ring. More points spread the carts more evenly.
+			max_workers (int, optional): The maximum number of threads of the bulk operations. Defaults to one per shard.
+			previous_shards (Mapping[str, CartStore], optional): The shards before the last change, including the removed ones.
+				The carts not found in their shard are looked up in their previous one, and moved. Once `rebalance()`
+				has run, they are no longer needed.
+		"""
+		if not shards:
+			raise ValueError("At least one shard is required.")
+
+		self.replicas = replicas
+		self.max_workers = max_workers
+		self._lock = threading.RLock()
+		self.shards: dict[str, CartStore] = dict(shards)
+		self._metrics: dict[str, ShardMetrics] = {}
+		self._ring = self._build_ring(self.shards)
+		self._previous_shards: Optional[dict[str, CartStore]] = None
+		self._previous_ring: Optional[tuple[list[int], list[str]]] = None
+
+		if previous_shards:
+			self._set_previous(dict(previous_shards))
+
+		for name in self._stores():
+			self._metrics[name] = ShardMetrics()
+
+	@staticmethod
+	def _hash(key: str) -> int:
+		return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+	def _build_ring(self, shards: Mapping[str, CartStore]) -> tuple[list[int], list[str]]:
+		points = sorted(
+			(self._hash(f"{name}#{replica}"), name)
+			for name in shards
+			for replica in range(self.replicas)
+		)
+		return [point for point, _ in points], [name for _, name in points]
+
+	def _set_previous(self, shards: Optional[dict[str, CartStore]]) -> None:
+		self._previous_shards = shards
+		self._previous_ring = self._build_ring(shards) if shards else None
+
+	def _stores(self) -> dict[str, CartStore]:
+		"""
+		Get every store that may hold carts: the shards, and the removed shards not rebalanced yet.
+		"""
+		return {**(self._previous_shards or {}), **self.shards}
+
+	@staticmethod
+	def _owner(ring: tuple[list[int], list[str]], cart_id: str) -> str:
+		points, names = ring
+		index = bisect.bisect(points, ShardedCartStore._hash(cart_id))
+		return names[index % len(names)]
+
+	def shard_for(self, cart_id: str) -> str:
+		"""
+		Get the name of the shard that owns a cart.
+		"""
+		return self._owner(self._ring, cart_id)
+
+	def _call(self, name: str, operation: str, method: str, *args):
+		start = time.perf_counter()
+
+		try:
+			return getattr(self._stores()[name], method)(*args)
+
+		finally:
+			self._metrics[name].record(operation, time.perf_counter() - start)
+
+	def _previous_owner(self, cart_id: str, owner: str) -> Optional[str]:
+		previous_ring = self._previous_ring
+
+		if previous_ring is None:
+			return None
+
+		previous = self._owner(previous_ring, cart_id)
+		return previous if previous != owner else None
+
+	def get(self, cart_id: str) -> Optional[dict[str, CartItem]]:
+		owner = self.shard_for(cart_id)
+		cart = self._call(owner, "reads", "get", cart_id)
+
+		if cart is None:
+			previous = self._previous_owner(cart_id, owner)
+
+			if previous is not None:
+				cart = self._call(previous, "reads", "get", cart_id)
+
+				if cart is not None and not self._move(cart_id, cart, previous, owner):
+					cart = self._call(owner, "reads", "get", cart_id)
+
+		return cart
+
+	def _move(self, cart_id: str, cart: dict[str, CartItem], source: str, target: str) -> bool:
+		"""
+		Move a cart to its new shard. The cart is only inserted if the new shard has none: a cart written there
+		meanwhile is newer than the one being moved, and the check and the write are a single step of the shard.
+
+		Returns:
+			bool: True if the cart was moved, False if the new shard already had a newer one.
+		"""
+		moved = self._call(target, "writes", "insert", cart_id, cart)
+		self._call(source, "deletes", "delete", cart_id)
+		self._metrics[target].record("migrations", 0.0)
+		return moved
+
+	def set(self, cart_id: str, cart: dict[str, CartItem]) -> None:
+		owner = self.shard_for(cart_id)
+		self._call(owner, "writes", "set", cart_id, cart)
+
+		previous = self._previous_owner(cart_id, owner)
+
+		if previous is not None:
+			self._call(previous, "deletes", "delete", cart_id)
+
+	def insert(self, cart_id: str, cart: dict[str, CartItem]) -> bool:
+		# A cart still in its previous shard is moved first, so it is found by the insert
+		return self.get(cart_id) is None and self._call(self.shard_for(cart_id), "writes", "insert", cart_id, cart)
+
+	def delete(self, cart_id: str) -> None:
+		owner = self.shard_for(cart_id)
+		self._call(owner, "deletes", "delete", cart_id)
+
+		previous = self._previous_owner(cart_id, owner)
+
+		if previous is not None:
+			self._call(previous, "deletes", "delete", cart_id)
+
+	def _parallel(self, function: Callable[[str], object]) -> dict[str, object]:
+		names = list(self._stores())
+
+		with ThreadPoolExecutor(max_workers=self.max_workers or len(names)) as executor:
+			return dict(zip(names, executor.map(function, names)))
+
+	def ids(self) -> list[str]:
+		results = self._parallel(lambda name: self._call(name, "reads", "ids"))
+		return list(dict.fromkeys(cart_id for ids in results.values() for cart_id in ids))  # type: ignore
+
+	def export(self) -> dict[str, dict[str, CartItem]]:
+		carts: dict[str, dict[str, CartItem]] = {}
+
+		for exported in self._parallel(lambda name: self._call(name, "reads", "export")).values():
+			carts.update(exported)  # type: ignore
+
+		return carts
+
+	def expire(self, max_age: float) -> int:
+		return sum(self._parallel(lambda name: self._call(name, "deletes", "expire", max_age)).values())  # type: ignore
+
+	def add_shard(self, name: str, store: CartStore) -> None:
+		"""
+		Add a shard to the ring of this process. The carts it now owns are moved to it when they are accessed, or by `rebalance()`.
+		"""
+		with self._lock:
+			if name in self.shards:
+				raise ValueError(f"The shard {name} already exists.")
+
+			if self._previous_ring is not None:
+				# Only one previous ring is looked up, so the pending moves must be finished first
+				self.rebalance()
+
+			self._metrics[name] = ShardMetrics()
+			self._set_previous(self.shards)
+			self.shards = dict(self.shards, **{name: store})
+			self._ring = self._build_ring(self.shards)
+
+	def remove_shard(self, name: str) -> None:
+		"""
+		Remove a shard from the ring of this process, and move its carts to their new shards.
+		The carts are routed to their new shards before they are moved, so the writes made meanwhile are not lost.
+		"""
+		with self._lock:
+			if name not in self.shards:
+				raise ValueError(f"The shard {name} does not exist.")
+
+			if len(self.shards) == 1:
+				raise ValueError("The last shard cannot be removed.")
+
+			if self._previous_ring is not None:
+				self.rebalance()
+
+			self._set_previous(self.shards)
+			self.shards = {key: store for key, store in self.shards.items() if key != name}
+			self._ring = self._build_ring(self.shards)
+			self.rebalance()
+
+	def rebalance(self) -> int:
+		"""
+		Move every cart that is not in the shard that owns it, in parallel per shard,
+		and stop looking up the previous shards.
+
+		Returns:
+			int: The number of moved carts.
+		"""
+		with self._lock:
+			def move_misplaced(name: str) -> int:
+				moved = 0
+
+				for cart_id, cart in self._call(name, "reads", "export").items():
+					owner = self.shard_for(cart_id)
+
+					if owner != name:
+						self._move(cart_id, cart, name, owner)
+						moved += 1
+
+				return moved
+
+			moved = sum(self._parallel(move_misplaced).values())  # type: ignore
+			self._set_previous(None)
+			return moved
+
+	def metrics(self) -> dict[str, dict]:
+		"""
+		Get the operation counters of each shard.
+
+		Returns:
+			dict: The counters by shard name: reads, writes, deletes, migrations and the time spent in them.
+		"""
+		return {name: metrics.as_dict() for name, metrics in self._metrics.items() if name in self.shards}
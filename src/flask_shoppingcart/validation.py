@@ -0,0 +1,197 @@
+from collections.abc import Mapping
+from decimal import Decimal
+from numbers import Number
+from typing import Callable, NamedTuple, Optional, Union
+
+#: A quantity converted for the checks: an integer count of units when a precision is set, a `Decimal` otherwise.
+Units = Union[int, Decimal]
+
+StockGetter = Callable[[str], Optional[Number]]
+
+
+class Violation(NamedTuple):
+	"""
+	A quantity that failed the validation.
+
+	The `code` is one of:
+	- `invalid`: the quantity is not a number.
+	- `precision`: the quantity has more decimal places than the precision allows.
+	The quantity already in the cart is checked as well: if it is rejected, the code is `invalid` or `precision`
+	and `quantity` is the quantity in the cart.
+	- `not_positive`: the quantity is 0 or less, and negative quantities are not allowed.
+	- `below_minimum` / `above_maximum`: the quantity is out of the limits of the validator.
+	- `out_of_stock`: the quantity exceeds the stock; `limit` is the stock.
+	"""
+
+	product_id: str
+	code: str
+	quantity: object
+	limit: Optional[Number] = None
+
+
+class ValidationResult(NamedTuple):
+	"""
+	The result of a validation: the normalized quantities of the valid lines, as `Decimal`s, and every violation found.
+	"""
+
+	quantities: dict[str, Decimal]
+	violations: list[Violation]
+
+	@property
+	def ok(self) -> bool:
+		return not self.violations
+
+
+class QuantityValidator:
+	"""
+	Validates many quantities at once, for bulk changes such as imports, merges or re-validating a whole cart.
+
+	The quantities are first converted, in one column, to a single exact type: integer counts of units when a
+	`precision` is set, `Decimal` otherwise. Ints, floats and Decimals can then be compared without rounding
+	surprises, and all the lines are checked against the stock and the limits in a single pass over the columns.
+	Every violation is returned, instead of raising on the first one. The normalized quantities are always `Decimal`s.
+	"""
+
+	def __init__(self,
+              precision: Optional[int] = None,
+              allow_negative: bool = False,
+              min_quantity: Optional[Number] = None,
+              max_quantity: Optional[Number] = None
+              ) -> None:
+		"""
+		Args:
+			precision (int, optional): The number of decimal places allowed in the quantities. The normalized quantities
+				have exactly that many decimal places (e.g. `Decimal('1.50')` with a precision of 2).
+				If not set, any number of decimal places is allowed, and the quantities are kept as they are.
+			allow_negative (bool): If True, quantities of 0 or less are allowed.
+			min_quantity (Number, optional): The minimum quantity of a line.
+			max_quantity (Number, optional): The maximum quantity of a line.
+		"""
+		if precision is not None and precision < 0:
+			raise ValueError("The precision cannot be negative.")
+
+		self.precision = precision
+		self.allow_negative = allow_negative
+		self.min_quantity = min_quantity
+		self.max_quantity = max_quantity
+		self._scale = Decimal(10) ** precision if precision is not None else None
+		self._min = self._to_limit(min_quantity)
+		self._max = self._to_limit(max_quantity)
+
+	@staticmethod
+	def _to_decimal(value: object) -> Optional[Decimal]:
+		"""
+		Convert a quantity to a `Decimal`, None if it is not a finite number.
+		Floats are converted from their shortest repr, so 0.1 is 0.1 and not 0.1000000000000000055...
+		"""
+		if isinstance(value, bool) or not isinstance(value, (int, float, Decimal)):
+			return None
+
+		number = Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+		return number if number.is_finite() else None
+
+	def _to_units(self, value: object) -> Optional[Units]:
+		"""
+		Convert a quantity to the type used by the checks.
+
+		Returns:
+			The converted quantity, None if it is not a number or does not fit the precision.
+		"""
+		if isinstance(value, int) and not isinstance(value, bool) and self._scale is not None:
+			return value * int(self._scale)
+
+		number = self._to_decimal(value)
+
+		if number is None or self._scale is None:
+			return number
+
+		units = number * self._scale
+		return int(units) if units == units.to_integral_value() else None
+
+	def _to_limit(self, value: Optional[Number]) -> Optional[Decimal]:
+		"""
+		Convert a limit or a stock to be compared with the converted quantities. Unlike the quantities,
+		it does not have to fit the precision. None, or a value that is not a number, means no limit.
+		"""
+		number = self._to_decimal(value)
+
+		if number is None or self._scale is None:
+			return number
+
+		return number * self._scale
+
+	def _from_units(self, units: Units) -> Decimal:
+		"""
+		Convert a quantity back from the type used by the checks to the normalized type, a `Decimal`
+		with as many decimal places as the precision, if set.
+		"""
+		if self.precision is None:
+			return units  # type: ignore
+
+		return Decimal(units).scaleb(-self.precision)
+
+	def _conversion_error(self, value: object) -> str:
+		"""
+		Get the violation code of a quantity that could not be converted.
+		"""
+		return "invalid" if self._to_decimal(value) is None else "precision"
+
+	def validate(self,
+              quantities: Mapping[str, Number],
+              get_stock: Optional[StockGetter] = None,
+              current: Optional[Mapping[str, Number]] = None
+              ) -> ValidationResult:
+		"""
+		Validate and normalize quantities.
+
+		Args:
+			quantities (Mapping[str, Number]): The quantity of each product.
+			get_stock (Callable, optional): Returns the stock of a product, None if it is not limited.
+				If not set, the stock is not validated.
+			current (Mapping[str, Number], optional): The quantities already in the cart. If set, `quantities` are added
+				to them: the sign is checked on the added quantities, and the stock and limits on the totals.
+
+		Returns:
+			ValidationResult: The normalized quantities (the totals, if `current` is set) and the violations.
+		"""
+		current = current or {}
+		product_ids = list(quantities)
+		originals = [quantities[product_id] for product_id in product_ids]
+		units = [self._to_units(quantity) for quantity in originals]
+		currents = [current.get(product_id, 0) for product_id in product_ids]
+		bases = [self._to_units(quantity) for quantity in currents]
+		stocks = [get_stock(product_id) for product_id in product_ids] if get_stock is not None else [None] * len(product_ids)
+		limits = [self._to_limit(stock) for stock in stocks]
+
+		normalized: dict[str, Decimal] = {}
+		violations: list[Violation] = []
+
+		for product_id, original, quantity, in_cart, base, stock, limit in zip(
+			product_ids, originals, units, currents, bases, stocks, limits
+		):
+			if quantity is None:
+				violations.append(Violation(product_id, self._conversion_error(original), original))
+				continue
+
+			if base is None:
+				violations.append(Violation(product_id, self._conversion_error(in_cart), in_cart))
+				continue
+
+			total = base + quantity
+
+			if not self.allow_negative and quantity <= 0:
+				violations.append(Violation(product_id, "not_positive", original))
+
+			elif self._min is not None and total < self._min:
+				violations.append(Violation(product_id, "below_minimum", original, self.min_quantity))
+
+			elif self._max is not None and total > self._max:
+				violations.append(Violation(product_id, "above_maximum", original, self.max_quantity))
+
+			elif limit is not None and total > limit:
+				violations.append(Violation(product_id, "out_of_stock", original, stock))
+
+			else:
+				normalized[product_id] = self._from_units(total)
+
+		return ValidationResult(normalized, violations)
@@ -5,6 +5,18 @@ from src.flask_shoppingcart._shoppingcart import ShoppingCartBase
 from src.flask_shoppingcart.flask_shoppingcart import FlaskShoppingCart
 
 
+class FakeClock:
+    """
+    A clock for the TTL of the reservations and the stored carts, moved forward by the tests.
+    """
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
 @pytest.fixture
 def app():
     app = Flask(__name__)
@@ -28,3 +40,8 @@ def cart(app: Flask):
 @pytest.fixture
 def cart_base(app: Flask):
     return ShoppingCartBase(app)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
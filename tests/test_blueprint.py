@@ -0,0 +1,114 @@
+# type: ignore
+
+import pytest
+from flask import Flask
+
+from src.flask_shoppingcart import FlaskShoppingCart, create_cart_blueprint
+
+
+@pytest.fixture
+def api(app: Flask, cart: FlaskShoppingCart):
+	app.register_blueprint(create_cart_blueprint(cart, url_prefix='/api', get_stock={'product_1': 5}.get))
+	return app.test_client()
+
+
+class TestCartBlueprint:
+	def test_view_cart_empty_success(self, api):
+		response = api.get('/api/cart')
+
+		assert response.status_code == 200
+		assert response.json == {}
+		assert response.headers['ETag']
+
+	def test_add_and_view_cart_success(self, api):
+		response = api.post('/api/cart/items/product_1', json={'quantity': 2, 'extra': {'color': 'red'}})
+
+		assert response.status_code == 200
+		assert response.json == {'product_1': {'quantity': 2, 'extra': {'color': 'red'}}}
+		assert api.get('/api/cart').json == response.json
+
+	def test_conditional_get_not_modified(self, api):
+		etag = api.post('/api/cart/items/product_1', json={}).headers['ETag']
+
+		response = api.get('/api/cart', headers={'If-None-Match': etag})
+		assert response.status_code == 304
+		assert response.data == b''
+		assert not response.headers.getlist('Set-Cookie')
+
+		api.post('/api/cart/items/product_1', json={})
+		response = api.get('/api/cart', headers={'If-None-Match': etag})
+		assert response.status_code == 200
+		assert response.headers['ETag'] != etag
+
+	def test_conditional_write_precondition_failed(self, api):
+		etag = api.post('/api/cart/items/product_1', json={}).headers['ETag']
+		api.post('/api/cart/items/product_1', json={})
+
+		response = api.delete('/api/cart', headers={'If-Match': etag})
+		assert response.status_code == 412
+		assert api.get('/api/cart').json['product_1']['quantity'] == 2
+
+		response = api.delete('/api/cart', headers={'If-Match': response.headers['ETag']})
+		assert response.status_code == 200
+		assert response.json == {}
+
+	def test_subtract_and_remove_success(self, api):
+		api.post('/api/cart/items/product_1', json={'quantity': 3})
+
+		assert api.post('/api/cart/items/product_1/subtract', json={'quantity': 2}).json['product_1']['quantity'] == 1
+		assert api.delete('/api/cart/items/product_1').json == {}
+
+	def test_extra_data_success(self, api):
+		api.post('/api/cart/items/product_1', json={})
+
+		api.patch('/api/cart/items/product_1/extra', json={'color': 'red', 'size': 'M'})
+		assert api.get('/api/cart/items/product_1/extra').json == {'color': 'red', 'size': 'M'}
+
+		api.delete('/api/cart/items/product_1/extra/color')
+		assert api.get('/api/cart/items/product_1/extra').json == {'size': 'M'}
+
+		api.delete('/api/cart/items/product_1/extra')
+		assert api.get('/api/cart/items/product_1').json == {'quantity': 1}
+
+	@pytest.mark.parametrize('method, url, kwargs, status', [
+		('post', '/api/cart/items/product_1', {'json': {'quantity': 6}}, 409),
+		('post', '/api/cart/items/product_1', {'json': {'quantity': -1}}, 400),
+		('post', '/api/cart/items/product_1', {'json': {'quantity': True}}, 400),
+		('post', '/api/cart/items/product_1', {'json': {'quantity': '2'}}, 400),
+		('post', '/api/cart/items/product_1', {'json': {'extra': ['red']}}, 400),
+		('post', '/api/cart/items/product_1', {'json': [1]}, 400),
+		('post', '/api/cart/items/product_1', {}, 400),
+		('post', '/api/cart/items/product_1', {'data': {'quantity': '1'}}, 400),
+		('patch', '/api/cart/items/product_1/extra', {'json': ['red']}, 400),
+		('post', '/api/cart/items/product_2/subtract', {'json': {}}, 404),
+		('delete', '/api/cart/items/product_2', {}, 404),
+		('get', '/api/cart/items/product_2', {}, 404),
+	])
+	def test_errors(self, api, method, url, kwargs, status):
+		response = getattr(api, method)(url, **kwargs)
+
+		assert response.status_code == status
+		assert 'error' in response.json
+
+	def test_rejected_request_changes_nothing(self, api):
+		api.post('/api/cart/items/product_1', json={})
+		response = api.post('/api/cart/items/product_1', data={'quantity': '1'})
+
+		assert response.json['message'] == 'The request body must be a JSON object.'
+		assert api.get('/api/cart').json == {'product_1': {'quantity': 1}}
+
+	def test_server_errors_are_not_client_errors(self, app, cart, api):
+		app.config['PROPAGATE_EXCEPTIONS'] = False
+		cart.add = lambda *args, **kwargs: int('bug')
+
+		assert api.post('/api/cart/items/product_1', json={}).status_code == 500
+
+	def test_negative_quantities_allowed(self, app):
+		app.config['FLASK_SHOPPING_CART_ALLOW_NEGATIVE_QUANTITY'] = 1
+		cart = FlaskShoppingCart(app)
+		app.register_blueprint(create_cart_blueprint(cart, url_prefix='/api'))
+		api = app.test_client()
+
+		api.post('/api/cart/items/product_1', json={'quantity': 1})
+
+		assert api.post('/api/cart/items/product_1/subtract', json={'quantity': 2}).json == {'product_1': {'quantity': -1}}
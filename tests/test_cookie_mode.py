@@ -0,0 +1,133 @@
+# type: ignore
+
+import pytest
+from flask import Flask, session
+
+from src.flask_shoppingcart import FlaskShoppingCart, MemoryCartStore
+
+
+class StoreSpy(MemoryCartStore):
+	reads = 0
+
+	def get(self, cart_id):
+		self.reads += 1
+		return super().get(cart_id)
+
+
+def _routes(app: Flask, cart: FlaskShoppingCart):
+	@app.route('/add/<product_id>/<int:quantity>')
+	def add(product_id, quantity):
+		cart.add(product_id, quantity)
+		return ''
+
+	@app.route('/remove/<product_id>')
+	def remove(product_id):
+		cart.remove(product_id)
+		return ''
+
+	@app.route('/clear')
+	def clear():
+		cart.clear()
+		return ''
+
+	@app.route('/')
+	def index():
+		return ''
+
+	return app.test_client()
+
+
+class TestSummaryCookie:
+	@pytest.fixture
+	def client(self, app: Flask):
+		app.config['FLASK_SHOPPING_CART_COOKIE_MODE'] = 'summary'
+		return _routes(app, FlaskShoppingCart(app))
+
+	def test_summary_follows_changes(self, client):
+		client.get('/add/product_1/2')
+		assert client.get_cookie('test_cart').value == '1:2'
+
+		client.get('/add/product_2/3')
+		assert client.get_cookie('test_cart').value == '2:5'
+
+		client.get('/remove/product_1')
+		assert client.get_cookie('test_cart').value == '1:3'
+
+		client.get('/clear')
+		assert client.get_cookie('test_cart').value == '0:0'
+
+	def test_cookie_only_set_when_changed(self, client):
+		client.get('/add/product_1/2')
+
+		assert 'test_cart=' not in client.get('/').headers.get('Set-Cookie', '')
+		assert 'test_cart=1:4' in client.get('/add/product_1/2').headers['Set-Cookie']
+
+	def test_no_session_for_empty_cart(self, client):
+		response = client.get('/')
+
+		assert response.headers['Set-Cookie'].startswith('test_cart=0:0')
+		assert 'session=' not in response.headers['Set-Cookie']
+
+	def test_summary_with_version(self, app: Flask):
+		app.config['FLASK_SHOPPING_CART_COOKIE_MODE'] = 'summary'
+		app.config['FLASK_SHOPPING_CART_COOKIE_SUMMARY_VERSION'] = True
+		cart = FlaskShoppingCart(app)
+		client = _routes(app, cart)
+
+		client.get('/add/product_1/2')
+
+		with client.session_transaction() as sess:
+			version = sess['test_cart_version']
+
+		assert client.get_cookie('test_cart').value == f'1:2:{version}'
+
+	def test_summary_of_stored_cart(self, app: Flask):
+		app.config['FLASK_SHOPPING_CART_COOKIE_MODE'] = 'summary'
+		store = MemoryCartStore()
+		cart = FlaskShoppingCart(app, storage=store)
+
+		with app.test_request_context():
+			cart.add('product_1', 2)
+			stale = dict(session)
+
+			assert 'test_cart_summary' not in session
+			assert cart.snapshot().total_quantity == 2
+
+		# Two concurrent requests of the same session change the stored cart, and the session of the first one is saved last
+		for product_id in ('product_2', 'product_3'):
+			with app.test_request_context():
+				session.update(stale)
+				cart.add(product_id)
+
+		with app.test_request_context():
+			session.update(stale)
+
+			assert cart._get_summary() == [3, 4]
+			assert store.get(session['test_cart_id'])['lines'] == cart.get_cart()
+
+	def test_summary_of_stored_cart_without_cart(self, app: Flask):
+		app.config['FLASK_SHOPPING_CART_COOKIE_MODE'] = 'summary'
+		store = StoreSpy()
+		client = _routes(app, FlaskShoppingCart(app, storage=store))
+
+		assert client.get('/').headers['Set-Cookie'].startswith('test_cart=0:0')
+		assert store.reads == 0
+
+
+class TestCookieModeOff:
+	def test_no_cookie(self, app: Flask):
+		app.config['FLASK_SHOPPING_CART_COOKIE_MODE'] = 'off'
+		client = _routes(app, FlaskShoppingCart(app))
+
+		response = client.get('/add/product_1/2')
+		assert 'test_cart=' not in response.headers.get('Set-Cookie', '')
+
+		client.set_cookie('test_cart', '{}')
+		client.get('/')
+		assert client.get_cookie('test_cart') is None
+
+	def test_invalid_mode_fail(self, app: Flask):
+		app.config['FLASK_SHOPPING_CART_COOKIE_MODE'] = 'compact'
+
+		with pytest.raises(ValueError):
+			FlaskShoppingCart(app)
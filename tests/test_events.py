@@ -0,0 +1,163 @@
+# type: ignore
+
+import queue
+import threading
+
+import pytest
+from flask import Flask
+
+from src.flask_shoppingcart import CartEvent, EventDispatcher, FlaskShoppingCart
+
+
+class Collector:
+	def __init__(self):
+		self.batches = []
+		self.released = threading.Event()
+		self.released.set()
+
+	def __call__(self, batch):
+		self.released.wait()
+		self.batches.append(batch)
+
+	@property
+	def events(self):
+		return [event for batch in self.batches for event in batch]
+
+
+def _event(product_id='product_1'):
+	return CartEvent.from_change('add', 'cart_1', product_id, None, {'quantity': 1}, 'v1')
+
+
+class TestEventDispatcher:
+	def test_events_delivered_in_batches(self):
+		collector = Collector()
+		dispatcher = EventDispatcher(collector, batch_size=10, flush_interval=0.05)
+
+		for i in range(25):
+			assert dispatcher.publish(_event(f'product_{i}'))
+
+		dispatcher.close()
+
+		assert [event.product_id for event in collector.events] == [f'product_{i}' for i in range(25)]
+		assert all(len(batch) <= 10 for batch in collector.batches)
+		assert dispatcher.stats()['delivered'] == 25
+
+	@pytest.mark.parametrize('overflow, expected', [
+		('drop_newest', ['product_0', 'product_1', 'product_2']),
+		('drop_oldest', ['product_0', 'product_4', 'product_5']),
+		('block', ['product_0', 'product_1', 'product_2']),
+	])
+	def test_overflow_policies(self, overflow, expected):
+		collector = Collector()
+		collector.released.clear()
+		dispatcher = EventDispatcher(collector, max_queue=2, batch_size=1, overflow=overflow, block_timeout=0.01)
+
+		dispatcher.publish(_event('product_0'))
+		while dispatcher.stats()['queued']:
+			pass
+
+		for i in range(1, 6):
+			dispatcher.publish(_event(f'product_{i}'))
+
+		collector.released.set()
+		dispatcher.close()
+
+		assert [event.product_id for event in collector.events] == expected
+		assert dispatcher.stats()['dropped'] == 3
+
+	def test_handler_errors_are_counted(self):
+		def handler(batch):
+			raise RuntimeError()
+
+		dispatcher = EventDispatcher(handler)
+		dispatcher.publish(_event())
+		dispatcher.close()
+
+		assert dispatcher.stats()['failed'] == 1
+
+	def test_partial_batch_flushed_after_interval(self):
+		collector = Collector()
+		dispatcher = EventDispatcher(collector, batch_size=10, flush_interval=0.01)
+
+		dispatcher.publish(_event('product_0'))
+		while not collector.batches:
+			pass
+
+		dispatcher.publish(_event('product_1'))
+		dispatcher.close()
+
+		assert [[event.product_id for event in batch] for batch in collector.batches] == [['product_0'], ['product_1']]
+
+	def test_publish_after_close_dropped(self):
+		dispatcher = EventDispatcher(Collector())
+		dispatcher.close()
+
+		assert dispatcher.publish(_event()) is False
+		assert dispatcher.stats()['published'] == 0
+
+	def test_drop_oldest_with_emptied_queue(self):
+		class RacingQueue:
+			# Full when publishing, but emptied by the worker before the oldest event could be dropped
+			def put_nowait(self, event):
+				raise queue.Full
+
+			def get_nowait(self):
+				raise queue.Empty
+
+		dispatcher = EventDispatcher(Collector(), overflow='drop_oldest')
+		dispatcher._ensure_worker()
+		worker_queue, dispatcher._queue = dispatcher._queue, RacingQueue()
+
+		assert dispatcher.publish(_event()) is False
+		assert dispatcher.dropped == 1
+
+		dispatcher._queue = worker_queue
+		dispatcher.close()
+
+	def test_unknown_overflow_fail(self):
+		with pytest.raises(ValueError):
+			EventDispatcher(Collector(), overflow='drop_all')
+
+	def test_event_extra_delta(self):
+		event = CartEvent.from_change(
+			'add_extra_data', 'cart_1', 'product_1',
+			{'quantity': 1, 'extra': {'color': 'red', 'size': 'M'}},
+			{'quantity': 1, 'extra': {'color': 'blue', 'gift': True}},
+			'v2'
+		)
+
+		assert event.extra_changed == {'color': 'blue', 'gift': True}
+		assert event.extra_removed == ('size',)
+
+
+class TestShoppingCartEvents:
+	def test_changes_are_published(self, app: Flask):
+		collector = Collector()
+		dispatcher = EventDispatcher(collector, flush_interval=0.01)
+		cart = FlaskShoppingCart(app, events=dispatcher)
+
+		with app.test_request_context():
+			cart.add('product_1', 2, extra={'color': 'red'})
+			cart.subtract('product_1')
+			cart.remove('product_1')
+			cart.add('product_2')
+			cart.add('product_3', 3, extra={'size': 'M'})
+			cart.clear()
+			cart.clear()
+			cart_id = cart.cart_id
+
+		dispatcher.close()
+
+		assert [(e.operation, e.product_id, e.old_quantity, e.new_quantity) for e in collector.events] == [
+			('add', 'product_1', None, 2),
+			('subtract', 'product_1', 2, 1),
+			('remove', 'product_1', 1, None),
+			('add', 'product_2', None, 1),
+			('add', 'product_3', None, 3),
+			('clear', 'product_2', 1, None),
+			('clear', 'product_3', 3, None),
+		]
+		assert collector.events[0].extra_changed == {'color': 'red'}
+		assert collector.events[-1].extra_removed == ('size',)
+		assert collector.events[-1].version == collector.events[-2].version
+		assert all(event.cart_id == cart_id for event in collector.events)
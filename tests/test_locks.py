@@ -0,0 +1,226 @@
+# type: ignore
+
+import fcntl
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+from flask import Flask, session
+
+from src.flask_shoppingcart import (CartLock, CartLockTimeoutError,
+                                    FileCartLock, FlaskShoppingCart,
+                                    MemoryCartStore, NullCartLock,
+                                    StripedCartLock, locks)
+
+
+def _try_lock(directory, queue):
+	lock = FileCartLock(directory)
+	try:
+		with lock.lock('cart_1', timeout=0.05):
+			queue.put(True)
+	except CartLockTimeoutError:
+		queue.put(False)
+
+
+class TestCartLock:
+	def test_striped_lock_serializes_same_cart(self):
+		lock = StripedCartLock()
+		inside = []
+		overlaps = []
+
+		def work():
+			with lock.lock('cart_1'):
+				if inside:
+					overlaps.append(True)
+				inside.append(True)
+				time.sleep(0.001)
+				inside.pop()
+
+		threads = [threading.Thread(target=work) for _ in range(20)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		assert not overlaps
+		assert lock.metrics.acquisitions == 20
+
+	def test_striped_lock_timeout_fail(self):
+		lock = StripedCartLock()
+		acquired = threading.Event()
+		done = threading.Event()
+
+		def hold():
+			with lock.lock('cart_1'):
+				acquired.set()
+				done.wait()
+
+		thread = threading.Thread(target=hold)
+		thread.start()
+		acquired.wait()
+
+		with pytest.raises(CartLockTimeoutError):
+			with lock.lock('cart_1', timeout=0.01):
+				pass
+
+		done.set()
+		thread.join()
+
+		metrics = lock.metrics.as_dict()
+		assert metrics['timeouts'] == 1
+		assert metrics['contentions'] == 1
+
+	def test_striped_lock_is_reentrant(self):
+		lock = StripedCartLock(stripes=1)
+
+		with lock.lock('cart_1', timeout=0):
+			with lock.lock('cart_2', timeout=0):
+				pass
+
+	def test_file_lock_between_processes(self, tmp_path):
+		lock = FileCartLock(str(tmp_path))
+		queue = multiprocessing.Queue()
+
+		with lock.lock('cart_1'):
+			process = multiprocessing.Process(target=_try_lock, args=(str(tmp_path), queue))
+			process.start()
+			assert queue.get(timeout=5) is False
+			process.join()
+
+		process = multiprocessing.Process(target=_try_lock, args=(str(tmp_path), queue))
+		process.start()
+		assert queue.get(timeout=5) is True
+		process.join()
+
+
+class TestFileCartLock:
+	@pytest.fixture
+	def lock(self, tmp_path):
+		return FileCartLock(str(tmp_path), stripes=1, poll_interval=0.001)
+
+	@pytest.fixture
+	def held_file(self, tmp_path, lock):
+		# flock locks belong to the open file, so a second descriptor of this process conflicts like another process
+		fd = os.open(str(tmp_path / 'cart-0.lock'), os.O_RDWR | os.O_CREAT)
+		fcntl.flock(fd, fcntl.LOCK_EX)
+		yield fd
+		os.close(fd)
+
+	def test_file_held_elsewhere_timeout_fail(self, lock, held_file):
+		with pytest.raises(CartLockTimeoutError):
+			with lock.lock('cart_1', timeout=0.01):
+				pass
+
+		assert lock.metrics.timeouts == 1
+
+		# The thread lock of the stripe was released along with the failed attempt
+		fcntl.flock(held_file, fcntl.LOCK_UN)
+		with lock.lock('cart_1', timeout=0):
+			pass
+
+	def test_file_released_elsewhere_success(self, lock, held_file):
+		timer = threading.Timer(0.02, fcntl.flock, (held_file, fcntl.LOCK_UN))
+		timer.start()
+
+		with lock.lock('cart_1'):
+			pass
+
+		timer.join()
+		assert lock.metrics.acquisitions == 1
+
+	def test_file_lock_timeout_between_threads_fail(self, lock):
+		acquired = threading.Event()
+		done = threading.Event()
+
+		def hold():
+			with lock.lock('cart_1'):
+				acquired.set()
+				done.wait()
+
+		thread = threading.Thread(target=hold)
+		thread.start()
+		acquired.wait()
+
+		with pytest.raises(CartLockTimeoutError):
+			with lock.lock('cart_2', timeout=0.01):
+				pass
+
+		done.set()
+		thread.join()
+
+	def test_file_lock_is_reentrant(self, lock):
+		with lock.lock('cart_1'):
+			with lock.lock('cart_2', timeout=0):
+				pass
+
+			assert lock._depths == [1]
+
+		assert lock._depths == [0]
+
+	def test_files_reopened_after_fork(self, lock):
+		with lock.lock('cart_1'):
+			pass
+
+		inherited = lock._files[0]
+		lock._pid = -1  # as seen from a forked child
+
+		with lock.lock('cart_1'):
+			assert lock._files[0] != inherited
+			assert lock._pid == os.getpid()
+
+	def test_requires_fcntl(self, tmp_path, monkeypatch):
+		monkeypatch.setattr(locks, 'fcntl', None)
+
+		with pytest.raises(RuntimeError):
+			FileCartLock(str(tmp_path))
+
+
+class TestCartLockBase:
+	def test_abstract_methods_fail(self):
+		lock = CartLock()
+
+		with pytest.raises(NotImplementedError):
+			lock._acquire('cart_1', None)
+
+		with pytest.raises(NotImplementedError):
+			lock._release('cart_1')
+
+	def test_null_lock(self):
+		lock = NullCartLock()
+
+		with lock.lock('cart_1', timeout=0):
+			pass
+
+		assert lock.metrics.acquisitions == 1
+
+	def test_invalid_stripes_fail(self):
+		with pytest.raises(ValueError):
+			StripedCartLock(stripes=0)
+
+
+class TestShoppingCartLock:
+	def test_mutations_take_the_lock(self, app: Flask):
+		lock = StripedCartLock()
+		cart = FlaskShoppingCart(app, lock=lock, storage=MemoryCartStore())
+
+		with app.test_request_context():
+			cart.add('product_1', 2)
+			cart.subtract('product_1')
+			cart.clear()
+
+		assert lock.metrics.acquisitions == 3
+
+	def test_lock_without_storage_fail(self, app: Flask, tmp_path):
+		for lock in (StripedCartLock(), FileCartLock(str(tmp_path))):
+			with pytest.raises(ValueError):
+				FlaskShoppingCart(app, lock=lock)
+
+	def test_null_lock_does_not_create_cart_id(self, app: Flask):
+		cart = FlaskShoppingCart(app, lock=NullCartLock())
+
+		with app.test_request_context():
+			cart.add('product_1')
+
+			assert 'test_cart_id' not in session
@@ -0,0 +1,122 @@
+# type: ignore
+
+import threading
+
+import pytest
+from flask import Flask, session
+
+from src.flask_shoppingcart import (CartMigrations, CartSchemaError,
+                                    FlaskShoppingCart, MemoryCartStore,
+                                    StripedCartLock)
+
+
+@pytest.fixture
+def migrations():
+	migrations = CartMigrations(version=3)
+
+	@migrations.register(1)
+	def rename_colour(cart):
+		for item in cart.values():
+			if 'colour' in item.get('extra', {}):
+				item['extra']['color'] = item['extra'].pop('colour')
+		return cart
+
+	@migrations.register(2)
+	def integer_quantities(cart):
+		for item in cart.values():
+			item['quantity'] = int(item['quantity'])
+		return cart
+
+	return migrations
+
+
+class TestCartMigrations:
+	def test_upgrade_success(self, migrations):
+		cart = {'product_1': {'quantity': 2.0, 'extra': {'colour': 'red'}}}
+
+		assert migrations.upgrade(cart, 1) == {'product_1': {'quantity': 2, 'extra': {'color': 'red'}}}
+		assert migrations.upgrade({'product_1': {'quantity': 2.0}}, 2) == {'product_1': {'quantity': 2}}
+		assert cart == {'product_1': {'quantity': 2.0, 'extra': {'colour': 'red'}}}
+
+	def test_upgrade_missing_fail(self):
+		migrations = CartMigrations(version=2)
+
+		with pytest.raises(CartSchemaError):
+			migrations.upgrade({}, 1)
+
+	def test_upgrade_newer_version_fail(self, migrations):
+		with pytest.raises(CartSchemaError):
+			migrations.upgrade({}, 4)
+
+	def test_register_twice_fail(self, migrations):
+		with pytest.raises(ValueError):
+			migrations.register(1)(lambda cart: cart)
+
+
+class TestShoppingCartMigrations:
+	def test_old_cart_upgraded_lazily(self, app: Flask, migrations):
+		cart = FlaskShoppingCart(app, migrations=migrations)
+
+		with app.test_request_context():
+			session['test_cart'] = {'product_1': {'quantity': 2.0, 'extra': {'colour': 'red'}}}
+			session.modified = False
+
+			assert cart.get_product('product_1') == {'quantity': 2, 'extra': {'color': 'red'}}
+			assert cart.get_cart() is cart.get_cart()
+			assert not session.modified
+			assert 'test_cart_schema' not in session
+
+			cart.add('product_1')
+			assert session['test_cart'] == {'product_1': {'quantity': 3, 'extra': {'color': 'red'}}}
+			assert session['test_cart_schema'] == 3
+
+	def test_current_cart_is_not_upgraded(self, app: Flask, migrations):
+		cart = FlaskShoppingCart(app, migrations=migrations)
+
+		with app.test_request_context():
+			session['test_cart'] = {'product_1': {'quantity': 2.0, 'extra': {'colour': 'red'}}}
+			session['test_cart_schema'] = 3
+
+			assert cart.get_cart() is session['test_cart']
+
+	def test_stored_cart_upgraded_lazily(self, app: Flask, migrations):
+		store = MemoryCartStore()
+		store.set('cart_1', {'lines': {'product_1': {'quantity': 2.0}}, 'schema': 2})
+		cart = FlaskShoppingCart(app, storage=store, migrations=migrations)
+
+		with app.test_request_context():
+			session['test_cart_id'] = 'cart_1'
+
+			assert cart.get_cart() == {'product_1': {'quantity': 2}}
+			assert store.get('cart_1')['lines'] == {'product_1': {'quantity': 2.0}}
+
+			cart.subtract('product_1')
+			assert store.get('cart_1')['lines'] == {'product_1': {'quantity': 1}}
+			assert store.get('cart_1')['schema'] == 3
+			assert 'test_cart_schema' not in session
+
+	def test_stored_cart_upgraded_once(self, app: Flask):
+		migrations = CartMigrations(version=2)
+		migrations.register(1)(lambda cart: {product_id: {'quantity': item['quantity'] * 10} for product_id, item in cart.items()})
+
+		store = MemoryCartStore()
+		store.set('shared', {'lines': {'product_1': {'quantity': 1}}})
+		cart = FlaskShoppingCart(app, storage=store, lock=StripedCartLock(), migrations=migrations)
+
+		# Every request carries a session from before the upgrade
+		def add():
+			with app.test_request_context():
+				session['test_cart_id'] = 'shared'
+				cart.add('product_1')
+
+		threads = [threading.Thread(target=add) for _ in range(10)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		assert store.get('shared') == {
+			'lines': {'product_1': {'quantity': 20}},
+			'version': store.get('shared')['version'],
+			'schema': 2,
+		}
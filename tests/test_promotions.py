@@ -0,0 +1,188 @@
+# type: ignore
+
+import pytest
+from flask import Flask
+
+from src.flask_shoppingcart import (BuyXGetY, Discount, FlaskShoppingCart,
+                                    FreeItemOver, PercentOff, PromotionEngine,
+                                    Rule)
+
+
+class CountingPercentOff(PercentOff):
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.calls = 0
+
+	def line_discount(self, product_id, item, price):
+		self.calls += 1
+		return super().line_discount(product_id, item, price)
+
+
+@pytest.fixture
+def rules():
+	return [
+		BuyXGetY('3x4', buy=3, get=1, product_ids=['socks']),
+		CountingPercentOff('shoes-10', 10, extra={'category': 'shoes'}),
+		FreeItemOver('free-bag', 100, product_id='bag'),
+	]
+
+
+@pytest.fixture
+def engine(rules):
+	return PromotionEngine(rules)
+
+
+@pytest.fixture
+def cart(app: Flask, engine):
+	return FlaskShoppingCart(app, promotions=engine)
+
+
+class TestPromotionEngine:
+	def test_evaluate_success(self, engine):
+		cart = {
+			'socks': {'quantity': 8, 'extra': {'price': 5}},
+			'boots': {'quantity': 1, 'extra': {'price': 80, 'category': 'shoes'}},
+			'bag': {'quantity': 1, 'extra': {'price': 15}},
+		}
+
+		assert engine.evaluate('cart_1', 'v1', cart) == [
+			Discount('3x4', 10, ('socks',)),
+			Discount('shoes-10', 8.0, ('boots',)),
+			Discount('free-bag', 15, ('bag',)),
+		]
+
+	def test_evaluate_no_discounts(self, engine):
+		cart = {'hat': {'quantity': 1, 'extra': {'price': 5}}}
+
+		assert engine.evaluate('cart_1', 'v1', cart) == []
+
+	def test_notify_only_evaluates_affected_rules(self, engine, rules):
+		cart = {
+			'boots': {'quantity': 1, 'extra': {'price': 80, 'category': 'shoes'}},
+			'socks': {'quantity': 1, 'extra': {'price': 5}},
+		}
+		engine.evaluate('cart_1', 'v1', cart)
+		assert rules[1].calls == 1
+
+		cart['socks'] = {'quantity': 4, 'extra': {'price': 5}}
+		engine.notify('cart_1', 'v1', 'v2', 'socks', {'quantity': 1, 'extra': {'price': 5}}, cart['socks'])
+
+		assert engine.evaluate('cart_1', 'v2', cart)[0] == Discount('3x4', 5, ('socks',))
+		assert rules[1].calls == 1
+
+	def test_unknown_version_evaluates_from_scratch(self, engine, rules):
+		cart = {'boots': {'quantity': 1, 'extra': {'price': 80, 'category': 'shoes'}}}
+		engine.evaluate('cart_1', 'v1', cart)
+
+		cart['boots']['quantity'] = 2
+		assert engine.evaluate('cart_1', 'v2', cart) == [Discount('shoes-10', 16.0, ('boots',))]
+		assert rules[1].calls == 2
+
+	def test_rule_for_every_line(self):
+		engine = PromotionEngine([PercentOff('all-5', 5)])
+		cart = {'hat': {'quantity': 2, 'extra': {'price': 10}}}
+
+		assert engine.evaluate('cart_1', 'v1', cart) == [Discount('all-5', 1.0, ('hat',))]
+
+	def test_unhashable_extra_values_are_not_indexed(self, engine):
+		cart = {'boots': {'quantity': 1, 'extra': {'price': 80, 'category': 'shoes', 'sizes': [42, 43]}}}
+
+		assert engine.evaluate('cart_1', 'v1', cart) == [Discount('shoes-10', 8.0, ('boots',))]
+
+	def test_free_item_below_threshold(self, engine):
+		cart = {
+			'hat': {'quantity': 1, 'extra': {'price': 50}},
+			'bag': {'quantity': 1, 'extra': {'price': 15}},
+		}
+
+		assert engine.evaluate('cart_1', 'v1', cart) == []
+
+	def test_least_recently_used_carts_dropped(self, rules):
+		engine = PromotionEngine(rules, max_carts=2)
+
+		for i in range(3):
+			engine.evaluate(f'cart_{i}', 'v1', {})
+
+		assert list(engine._carts) == ['cart_1', 'cart_2']
+
+	def test_invalidate(self, engine, rules):
+		cart = {'boots': {'quantity': 1, 'extra': {'price': 80, 'category': 'shoes'}}}
+		engine.evaluate('cart_1', 'v1', cart)
+		engine.evaluate('cart_2', 'v1', cart)
+
+		engine.invalidate('cart_1')
+		engine.evaluate('cart_1', 'v1', cart)
+		engine.evaluate('cart_2', 'v1', cart)
+		assert rules[1].calls == 3
+
+		engine.invalidate()
+		assert not engine._carts
+
+
+class TestRule:
+	def test_matches(self):
+		rule = Rule('rule', product_ids=['boots'], extra={'category': 'shoes'})
+
+		assert rule.matches('boots', {'quantity': 1, 'extra': {'category': 'shoes'}})
+		assert not rule.matches('boots', {'quantity': 1})
+		assert not rule.matches('hat', {'quantity': 1, 'extra': {'category': 'shoes'}})
+
+	def test_abstract_methods_fail(self):
+		rule = Rule('rule')
+
+		with pytest.raises(NotImplementedError):
+			rule.line_discount('boots', {'quantity': 1}, 10)
+
+		with pytest.raises(NotImplementedError):
+			rule.cart_discount({}, lambda product_id, item: 10)
+
+	def test_buy_x_get_y_invalid_fail(self):
+		with pytest.raises(ValueError):
+			BuyXGetY('3x4', buy=0)
+
+
+class TestShoppingCartPromotions:
+	def test_get_discounts_follows_changes(self, cart: FlaskShoppingCart, app: Flask, rules):
+		with app.test_request_context():
+			cart.add('boots', 1, extra={'price': 80, 'category': 'shoes'})
+			assert cart.get_discounts() == [Discount('shoes-10', 8.0, ('boots',))]
+
+			cart.add('boots', 1)
+			cart.add('socks', 4, extra={'price': 5})
+			assert cart.get_discounts() == [
+				Discount('3x4', 5, ('socks',)),
+				Discount('shoes-10', 16.0, ('boots',)),
+			]
+			assert rules[1].calls == 2
+
+			cart.add_extra_data('boots', {'category': 'outlet'})
+			cart.subtract('socks')
+			assert cart.get_discounts() == []
+
+	def test_get_discounts_after_clear(self, cart: FlaskShoppingCart, app: Flask):
+		with app.test_request_context():
+			cart.add('socks', 4, extra={'price': 5})
+			assert cart.get_discounts()
+
+			cart.clear()
+			assert cart.get_discounts() == []
+
+	def test_get_discounts_without_engine(self, app: Flask):
+		cart = FlaskShoppingCart(app)
+
+		with app.test_request_context():
+			cart.add('socks', 4, extra={'price': 5})
+			assert cart.get_discounts() == []
+
+	def test_get_discounts_without_cart(self, app: Flask, engine):
+		app.config['FLASK_SHOPPING_CART_COOKIE_MODE'] = 'summary'
+		cart = FlaskShoppingCart(app, promotions=engine)
+
+		@app.route('/')
+		def index():
+			return {'discounts': cart.get_discounts()}
+
+		response = app.test_client().get('/')
+
+		assert response.json == {'discounts': []}
+		assert not [cookie for cookie in response.headers.getlist('Set-Cookie') if cookie.startswith('session=')]
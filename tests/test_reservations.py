@@ -0,0 +1,223 @@
+# type: ignore
+
+import sqlite3
+import threading
+
+import pytest
+from flask import Flask
+
+from src.flask_shoppingcart import (FlaskShoppingCart,
+                                    MemoryReservationLedger,
+                                    OutOfStokError, ReservationLedger,
+                                    SQLiteReservationLedger)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def ledger(request, clock, tmp_path):
+	if request.param == "memory":
+		return MemoryReservationLedger(clock=clock)
+
+	return SQLiteReservationLedger(str(tmp_path / "holds.db"), clock=clock)
+
+
+class TestReservationLedger:
+	def test_reserve_success(self, ledger):
+		ledger.reserve('product_1', 'cart_1', 2, 5, ttl=60)
+		ledger.reserve('product_1', 'cart_2', 3, 5, ttl=60)
+
+		assert ledger.held('product_1') == 5
+		assert ledger.available('product_1', 5) == 0
+		assert ledger.get_hold('product_1', 'cart_2') == 3
+
+	def test_reserve_replaces_own_hold_success(self, ledger):
+		ledger.reserve('product_1', 'cart_1', 2, 5, ttl=60)
+		ledger.reserve('product_1', 'cart_1', 5, 5, ttl=60)
+
+		assert ledger.held('product_1') == 5
+
+	def test_reserve_held_by_others_fail(self, ledger):
+		ledger.reserve('product_1', 'cart_1', 4, 5, ttl=60)
+
+		with pytest.raises(OutOfStokError):
+			ledger.reserve('product_1', 'cart_2', 2, 5, ttl=60)
+
+		assert ledger.held('product_1') == 4
+
+	def test_expired_hold_released_lazily(self, ledger, clock):
+		ledger.reserve('product_1', 'cart_1', 4, 5, ttl=60)
+		ledger.reserve('product_1', 'cart_2', 1, 5, ttl=120)
+
+		clock.now += 90
+		assert ledger.held('product_1') == 1
+		assert ledger.get_hold('product_1', 'cart_1') == 0
+
+		ledger.reserve('product_1', 'cart_3', 4, 5, ttl=60)
+
+	def test_adjust_renews_hold(self, ledger, clock):
+		ledger.reserve('product_1', 'cart_1', 4, 5, ttl=60)
+
+		clock.now += 50
+		ledger.adjust('product_1', 'cart_1', 2, ttl=60)
+
+		clock.now += 50
+		assert ledger.held('product_1') == 2
+
+	def test_adjust_without_hold_does_nothing(self, ledger):
+		ledger.adjust('product_1', 'cart_1', 2, ttl=60)
+
+		assert ledger.held('product_1') == 0
+
+	def test_adjust_to_zero_releases_hold(self, ledger):
+		ledger.reserve('product_1', 'cart_1', 4, 5, ttl=60)
+		ledger.reserve('product_1', 'cart_2', 1, 5, ttl=60)
+		ledger.adjust('product_1', 'cart_1', 0, ttl=60)
+
+		assert ledger.get_hold('product_1', 'cart_1') == 0
+		assert ledger.held('product_1') == 1
+
+	def test_reserve_zero_releases_hold(self, ledger):
+		ledger.reserve('product_1', 'cart_1', 4, 5, ttl=60)
+		ledger.reserve('product_1', 'cart_1', 0, 5, ttl=60)
+		ledger.reserve('product_1', 'cart_2', 0, 5, ttl=60)
+
+		assert ledger.held('product_1') == 0
+		assert ledger.get_hold('product_1', 'cart_2') == 0
+
+	def test_release_one_success(self, ledger):
+		ledger.reserve('product_1', 'cart_1', 2, 5, ttl=60)
+		ledger.release('product_1', 'cart_1')
+		ledger.release('product_1', 'cart_2')
+
+		assert ledger.held('product_1') == 0
+
+	def test_release_success(self, ledger):
+		ledger.reserve('product_1', 'cart_1', 2, 5, ttl=60)
+		ledger.reserve('product_2', 'cart_1', 1, 5, ttl=60)
+		ledger.release_all('cart_1', ['product_1', 'product_2', 'product_3'])
+
+		assert ledger.held('product_1') == 0
+		assert ledger.held('product_2') == 0
+
+	def test_concurrent_reserve_never_oversells(self, ledger):
+		errors = []
+
+		def reserve(holder_id):
+			try:
+				ledger.reserve('product_1', holder_id, 1, 10, ttl=60)
+			except OutOfStokError as e:
+				errors.append(e)
+
+		threads = [threading.Thread(target=reserve, args=(f'cart_{i}',)) for i in range(30)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		assert ledger.held('product_1') == 10
+		assert len(errors) == 20
+
+
+class TestSQLiteReservationLedger:
+	def test_reads_do_not_wait_for_writers(self, clock, tmp_path):
+		path = str(tmp_path / 'holds.db')
+		ledger = SQLiteReservationLedger(path, timeout=0.01, clock=clock)
+		ledger.reserve('product_1', 'cart_1', 4, 5, ttl=60)
+		ledger.reserve('product_1', 'cart_2', 1, 5, ttl=120)
+		clock.now += 90
+
+		writer = sqlite3.connect(path, isolation_level=None)
+		writer.execute('BEGIN IMMEDIATE')
+
+		try:
+			assert ledger.held('product_1') == 1
+			assert ledger.get_hold('product_1', 'cart_1') == 0
+			assert ledger.get_hold('product_1', 'cart_2') == 1
+		finally:
+			writer.execute('ROLLBACK')
+
+		# The expired hold is only purged by the next change of the product
+		assert writer.execute('SELECT COUNT(*) FROM holds').fetchone()[0] == 2
+		assert writer.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+class TestReservationLedgerBase:
+	def test_abstract_methods_fail(self):
+		ledger = ReservationLedger()
+
+		for method, args in [
+			(ledger.reserve, ('product_1', 'cart_1', 1, 5, 60)),
+			(ledger.adjust, ('product_1', 'cart_1', 1, 60)),
+			(ledger.release, ('product_1', 'cart_1')),
+			(ledger.get_hold, ('product_1', 'cart_1')),
+			(ledger.held, ('product_1',)),
+		]:
+			with pytest.raises(NotImplementedError):
+				method(*args)
+
+
+class TestShoppingCartReservations:
+	@pytest.fixture
+	def ledger(self, clock):
+		return MemoryReservationLedger(clock=clock)
+
+	@pytest.fixture
+	def cart(self, app: Flask, ledger):
+		return FlaskShoppingCart(app, reservations=ledger)
+
+	def test_add_holds_stock_success(self, cart: FlaskShoppingCart, app: Flask, ledger):
+		with app.test_request_context():
+			cart.add('product_1', 2, current_stock=3)
+			cart.add('product_1', 1, current_stock=3)
+
+			assert ledger.get_hold('product_1', cart.cart_id) == 3
+			assert cart.get_available_stock('product_1', 3) == 0
+
+	def test_add_held_by_other_cart_fail(self, cart: FlaskShoppingCart, app: Flask):
+		with app.test_request_context():
+			cart.add('product_1', 2, current_stock=3)
+
+		with app.test_request_context():
+			with pytest.raises(OutOfStokError):
+				cart.add('product_1', 2, current_stock=3)
+
+			assert 'product_1' not in cart.get_cart()
+
+	def test_subtract_and_remove_release_stock_success(self, cart: FlaskShoppingCart, app: Flask, ledger):
+		with app.test_request_context():
+			cart.add('product_1', 3, current_stock=3)
+			cart.subtract('product_1', 2)
+			assert ledger.held('product_1') == 1
+
+			cart.remove('product_1')
+			assert ledger.held('product_1') == 0
+
+	def test_clear_releases_stock_success(self, cart: FlaskShoppingCart, app: Flask, ledger):
+		with app.test_request_context():
+			cart.add('product_1', 3, current_stock=3)
+			cart.add('product_2', 1, current_stock=3)
+			cart.clear()
+
+			assert ledger.held('product_1') == 0
+			assert ledger.held('product_2') == 0
+
+	def test_add_invalid_extra_holds_nothing(self, cart: FlaskShoppingCart, app: Flask, ledger):
+		with app.test_request_context():
+			cart.add('product_1', 1, current_stock=5)
+
+			with pytest.raises(TypeError):
+				cart.add('product_1', 2, current_stock=5, extra=['bad'])
+
+			with pytest.raises(TypeError):
+				cart.add('product_2', 2, current_stock=5, extra=['bad'])
+
+			assert cart.get_cart() == {'product_1': {'quantity': 1}}
+			assert ledger.get_hold('product_1', cart.cart_id) == 1
+			assert ledger.held('product_2') == 0
+
+	def test_available_stock_without_ledger(self, app: Flask):
+		cart = FlaskShoppingCart(app)
+
+		with app.test_request_context():
+			cart.add('product_1', 2, current_stock=3)
+
+			assert cart.get_available_stock('product_1', 3) == 3
@@ -0,0 +1,100 @@
+# type: ignore
+
+import pickle
+
+import pytest
+from flask import Flask
+
+from src.flask_shoppingcart import CartLine, CartSnapshot, FlaskShoppingCart
+
+
+class TestCartSnapshot:
+	def test_snapshot_success(self, cart: FlaskShoppingCart, app: Flask):
+		with app.test_request_context():
+			cart.add('product_1', 2, extra={'color': 'red'})
+			cart.add('product_2', 3)
+			snapshot = cart.snapshot()
+
+			assert isinstance(snapshot, CartSnapshot)
+			assert snapshot.version == cart._get_cart_version()
+			assert snapshot.line_count == 2
+			assert snapshot.total_quantity == 5
+			assert snapshot['product_1'].quantity == 2
+			assert snapshot['product_1']['extra'] == {'color': 'red'}
+			assert snapshot.to_dict() == cart.get_cart()
+
+	def test_snapshot_is_read_only(self, cart: FlaskShoppingCart, app: Flask):
+		with app.test_request_context():
+			cart.add('product_1', 2, extra={'color': 'red'})
+			snapshot = cart.snapshot()
+
+			with pytest.raises(TypeError):
+				snapshot['product_2'] = {'quantity': 1}
+
+			with pytest.raises(TypeError):
+				snapshot['product_1']['quantity'] = 5
+
+			with pytest.raises(TypeError):
+				snapshot['product_1'].extra['color'] = 'blue'
+
+	def test_snapshot_is_not_altered_by_changes(self, cart: FlaskShoppingCart, app: Flask):
+		with app.test_request_context():
+			cart.add('product_1', 2, extra={'color': 'red'})
+			cart.add('product_2', 1)
+			snapshot = cart.snapshot()
+
+			cart.add('product_1', 1, extra={'size': 'M'})
+			cart.subtract('product_2')
+			cart.add('product_3')
+			cart.add_extra_data('product_1', {'color': 'blue'})
+
+			assert snapshot.to_dict() == {
+				'product_1': {'quantity': 2, 'extra': {'color': 'red'}},
+				'product_2': {'quantity': 1},
+			}
+			assert snapshot.version != cart._get_cart_version()
+			assert cart.get_cart() == {
+				'product_1': {'quantity': 3, 'extra': {'color': 'blue', 'size': 'M'}},
+				'product_3': {'quantity': 1},
+			}
+
+	def test_snapshot_copies_nothing(self, cart: FlaskShoppingCart, app: Flask):
+		with app.test_request_context():
+			cart.add('product_1', 2)
+			cart.add('product_2', 1)
+			snapshot = cart.snapshot()
+			assert snapshot._cart is cart.get_cart()
+
+			cart.add('product_1')
+			assert snapshot._cart['product_2'] is cart.get_cart()['product_2']
+
+	def test_snapshot_can_be_pickled(self, cart: FlaskShoppingCart, app: Flask):
+		with app.test_request_context():
+			cart.add('product_1', 2, extra={'color': 'red'})
+			snapshot = pickle.loads(pickle.dumps(cart.snapshot()))
+
+			assert snapshot.to_dict() == cart.get_cart()
+			assert snapshot.version == cart._get_cart_version()
+
+	def test_snapshot_mapping_protocol(self):
+		snapshot = CartSnapshot({'product_1': {'quantity': 2, 'extra': {'color': 'red'}}, 'product_2': {'quantity': 1}}, 'v1')
+
+		assert list(snapshot) == ['product_1', 'product_2']
+		assert len(snapshot) == 2
+		assert dict(snapshot['product_1']) == {'quantity': 2, 'extra': {'color': 'red'}}
+		assert len(snapshot['product_1']) == 2
+		assert snapshot['product_2'].extra is None
+		assert repr(snapshot) == "CartSnapshot({'product_1': {'quantity': 2, 'extra': {'color': 'red'}}, 'product_2': {'quantity': 1}}, version='v1')"
+		assert repr(snapshot['product_2']) == "CartLine({'quantity': 1})"
+
+	def test_known_total_quantity_is_not_computed(self):
+		snapshot = CartSnapshot({'product_1': {'quantity': 2}}, total_quantity=7)
+
+		assert snapshot.total_quantity == 7
+
+	def test_line_to_dict_is_a_copy(self):
+		item = {'quantity': 2, 'extra': {'color': 'red'}}
+		line = CartLine(item).to_dict()
+		line['extra']['color'] = 'blue'
+
+		assert item == {'quantity': 2, 'extra': {'color': 'red'}}
@@ -0,0 +1,325 @@
+# type: ignore
+
+import sqlite3
+import threading
+import time
+
+import pytest
+from flask import Flask, session
+
+from src.flask_shoppingcart import (CartStore, FlaskShoppingCart,
+                                    MemoryCartStore, ShardedCartStore,
+                                    SQLiteCartStore, StripedCartLock,
+                                    create_cart_blueprint)
+
+
+class SlowMemoryCartStore(MemoryCartStore):
+	def get(self, cart_id):
+		cart = super().get(cart_id)
+		time.sleep(0.001)
+		return cart
+
+
+@pytest.fixture(params=["memory", "sqlite", "sharded"])
+def store(request, clock, tmp_path):
+	if request.param == "memory":
+		return MemoryCartStore(clock=clock)
+
+	if request.param == "sqlite":
+		return SQLiteCartStore(str(tmp_path / "carts.db"), clock=clock)
+
+	return ShardedCartStore({
+		f"shard_{i}": SQLiteCartStore(str(tmp_path / f"carts_{i}.db"), clock=clock)
+		for i in range(3)
+	})
+
+
+class TestCartStore:
+	def test_set_get_delete_success(self, store):
+		store.set('cart_1', {'product_1': {'quantity': 2, 'extra': {'color': 'red'}}})
+
+		assert store.get('cart_1') == {'product_1': {'quantity': 2, 'extra': {'color': 'red'}}}
+		assert store.get('cart_2') is None
+
+		store.delete('cart_1')
+		assert store.get('cart_1') is None
+
+	def test_insert_only_when_missing(self, store):
+		assert store.insert('cart_1', {'product_1': {'quantity': 1}})
+		assert not store.insert('cart_1', {'product_1': {'quantity': 2}})
+
+		assert store.get('cart_1') == {'product_1': {'quantity': 1}}
+
+	def test_get_returns_a_copy(self, store):
+		store.set('cart_1', {'product_1': {'quantity': 2}})
+		store.get('cart_1')['product_1']['quantity'] = 5
+
+		assert store.get('cart_1') == {'product_1': {'quantity': 2}}
+
+	def test_export_and_expire(self, store, clock):
+		for i in range(10):
+			store.set(f'cart_{i}', {'product_1': {'quantity': i + 1}})
+			clock.now += 10
+
+		assert sorted(store.ids()) == sorted(f'cart_{i}' for i in range(10))
+		assert store.export()['cart_3'] == {'product_1': {'quantity': 4}}
+
+		assert store.expire(45) == 6
+		assert sorted(store.export()) == ['cart_6', 'cart_7', 'cart_8', 'cart_9']
+
+	def test_sqlite_incompatible_database_fail(self, tmp_path):
+		path = str(tmp_path / 'carts.db')
+		connection = sqlite3.connect(path)
+		connection.execute('CREATE TABLE carts (cart_id TEXT PRIMARY KEY, data TEXT)')
+		connection.close()
+
+		with pytest.raises(sqlite3.OperationalError):
+			SQLiteCartStore(path)
+
+
+class TestShardedCartStore:
+	@pytest.fixture
+	def sharded(self):
+		return ShardedCartStore({f"shard_{i}": MemoryCartStore() for i in range(3)})
+
+	def test_carts_are_spread_over_shards(self, sharded):
+		for i in range(300):
+			sharded.set(f'cart_{i}', {'product_1': {'quantity': 1}})
+
+		sizes = [len(store.ids()) for store in sharded.shards.values()]
+		assert sum(sizes) == 300
+		assert min(sizes) > 50
+
+		metrics = sharded.metrics()
+		assert sum(shard['writes'] for shard in metrics.values()) == 300
+
+	def test_add_shard_moves_carts_lazily(self, sharded):
+		for i in range(100):
+			sharded.set(f'cart_{i}', {'product_1': {'quantity': i}})
+
+		sharded.add_shard('shard_3', MemoryCartStore())
+		moved = [f'cart_{i}' for i in range(100) if sharded.shard_for(f'cart_{i}') == 'shard_3']
+		assert moved
+		assert not sharded.shards['shard_3'].ids()
+
+		assert sharded.get(moved[0]) == {'product_1': {'quantity': int(moved[0][5:])}}
+		assert sharded.shards['shard_3'].ids() == [moved[0]]
+		assert sharded.metrics()['shard_3']['migrations'] == 1
+
+		assert sharded.rebalance() == len(moved) - 1
+		assert sorted(sharded.shards['shard_3'].ids()) == sorted(moved)
+		assert all(sharded.get(f'cart_{i}') == {'product_1': {'quantity': i}} for i in range(100))
+
+	def test_lazy_move_keeps_a_concurrent_write(self):
+		class PausedStore(MemoryCartStore):
+			paused = None
+
+			def get(self, cart_id):
+				cart = super().get(cart_id)
+
+				# A locked change writes the cart while the reader is paused before the move
+				if cart_id == self.paused:
+					self.paused = None
+					sharded.set(cart_id, {'product_1': {'quantity': 5}})
+
+				return cart
+
+		sharded = ShardedCartStore({f"shard_{i}": PausedStore() for i in range(3)})
+
+		for i in range(100):
+			sharded.set(f'cart_{i}', {'product_1': {'quantity': 1}})
+
+		sharded.add_shard('shard_3', MemoryCartStore())
+		cart_id = next(f'cart_{i}' for i in range(100) if sharded.shard_for(f'cart_{i}') == 'shard_3')
+		sharded.shards[sharded._previous_owner(cart_id, 'shard_3')].paused = cart_id
+
+		assert sharded.get(cart_id) == {'product_1': {'quantity': 5}}
+		assert sharded.shards['shard_3'].get(cart_id) == {'product_1': {'quantity': 5}}
+		assert sharded.insert(cart_id, {'product_1': {'quantity': 9}}) is False
+
+	def test_remove_shard_moves_its_carts(self, sharded):
+		for i in range(100):
+			sharded.set(f'cart_{i}', {'product_1': {'quantity': i}})
+
+		sharded.remove_shard('shard_0')
+
+		assert 'shard_0' not in sharded.shards
+		assert len(sharded.ids()) == 100
+		assert all(sharded.get(f'cart_{i}') == {'product_1': {'quantity': i}} for i in range(100))
+
+	def test_set_and_delete_clean_the_previous_shard(self, sharded):
+		for i in range(100):
+			sharded.set(f'cart_{i}', {'product_1': {'quantity': i}})
+
+		sharded.add_shard('shard_3', MemoryCartStore())
+		moved = [f'cart_{i}' for i in range(100) if sharded.shard_for(f'cart_{i}') == 'shard_3']
+
+		sharded.set(moved[0], {'product_1': {'quantity': 1000}})
+		sharded.delete(moved[1])
+
+		assert sharded.ids().count(moved[0]) == 1
+		assert sharded.get(moved[0]) == {'product_1': {'quantity': 1000}}
+		assert moved[1] not in sharded.ids()
+		assert sharded.get(moved[1]) is None
+
+	def test_pending_moves_finished_before_next_change(self, sharded):
+		for i in range(100):
+			sharded.set(f'cart_{i}', {'product_1': {'quantity': i}})
+
+		sharded.add_shard('shard_3', MemoryCartStore())
+		sharded.add_shard('shard_4', MemoryCartStore())
+		sharded.remove_shard('shard_3')
+
+		assert all(sharded.get(f'cart_{i}') == {'product_1': {'quantity': i}} for i in range(100))
+		assert all(sharded.shard_for(cart_id) == name for name, store in sharded.shards.items() for cart_id in store.ids())
+
+	def test_remove_shard_keeps_writes_made_during_the_move(self, sharded):
+		class RacingStore(MemoryCartStore):
+			armed = False
+			writes = 0
+
+			def export(self):
+				carts = super().export()
+
+				# A request changes the carts right after they were exported
+				if self.armed:
+					self.writes += 1
+					for cart_id in carts:
+						sharded.set(cart_id, {'product_1': {'quantity': -self.writes}})
+
+				return carts
+
+		racing = RacingStore()
+		sharded.add_shard('racing', racing)
+		sharded.rebalance()
+
+		for i in range(100):
+			sharded.set(f'cart_{i}', {'product_1': {'quantity': i}})
+
+		owned = racing.ids()
+		assert owned
+
+		racing.armed = True
+		sharded.remove_shard('racing')
+
+		assert all(sharded.get(cart_id) == {'product_1': {'quantity': -racing.writes}} for cart_id in owned)
+		assert not racing.ids()
+
+	def test_previous_shards_shared_by_workers(self):
+		stores = {f"shard_{i}": MemoryCartStore() for i in range(4)}
+		old = ShardedCartStore({name: stores[name] for name in ('shard_0', 'shard_1', 'shard_2')})
+
+		for i in range(100):
+			old.set(f'cart_{i}', {'product_1': {'quantity': i}})
+
+		# Every worker restarts with the new shards, shard_2 removed and shard_3 added, and the previous ones
+		workers = [
+			ShardedCartStore(
+				{name: stores[name] for name in ('shard_0', 'shard_1', 'shard_3')},
+				previous_shards={name: stores[name] for name in ('shard_0', 'shard_1', 'shard_2')},
+			)
+			for _ in range(2)
+		]
+
+		assert all(workers[i % 2].get(f'cart_{i}') == {'product_1': {'quantity': i}} for i in range(0, 100, 3))
+		assert sorted(workers[1].ids()) == sorted(f'cart_{i}' for i in range(100))
+
+		workers[0].rebalance()
+
+		assert not stores['shard_2'].ids()
+		assert all(workers[1].get(f'cart_{i}') == {'product_1': {'quantity': i}} for i in range(100))
+		assert 'shard_2' not in workers[0].metrics()
+
+	@pytest.mark.parametrize('change', [
+		lambda sharded: sharded.add_shard('shard_0', MemoryCartStore()),
+		lambda sharded: sharded.remove_shard('shard_9'),
+		lambda sharded: [sharded.remove_shard(f'shard_{i}') for i in range(3)],
+		lambda sharded: ShardedCartStore({}),
+	])
+	def test_invalid_shards_fail(self, sharded, change):
+		with pytest.raises(ValueError):
+			change(sharded)
+
+
+class TestCartStoreBase:
+	def test_abstract_methods_fail(self):
+		store = CartStore()
+
+		for method, args in [
+			(store.get, ('cart_1',)),
+			(store.set, ('cart_1', {})),
+			(store.insert, ('cart_1', {})),
+			(store.delete, ('cart_1',)),
+			(store.ids, ()),
+			(store.expire, (60,)),
+		]:
+			with pytest.raises(NotImplementedError):
+				method(*args)
+
+
+class TestShoppingCartStorage:
+	def test_cart_is_stored(self, app: Flask):
+		store = MemoryCartStore()
+		cart = FlaskShoppingCart(app, storage=store)
+
+		with app.test_request_context():
+			cart.add('product_1', 2)
+			assert 'test_cart' not in session
+			assert store.get(cart.cart_id) == {'lines': {'product_1': {'quantity': 2}}, 'version': cart._get_cart_version()}
+
+			cart.clear()
+			assert store.ids() == []
+
+	def test_version_is_stored_with_the_cart(self, app: Flask):
+		store = MemoryCartStore()
+		cart = FlaskShoppingCart(app, storage=store, lock=StripedCartLock())
+		app.register_blueprint(create_cart_blueprint(cart, url_prefix='/api'))
+
+		with app.test_request_context():
+			cart.add('seed')
+			stale = dict(session)
+
+		# Two overlapping requests of the session, and the session cookie of the first one is kept by the browser
+		with app.test_request_context():
+			session.update(stale)
+			cart.add('product_1')
+			etag = cart._get_cart_version()
+
+		with app.test_request_context():
+			session.update(stale)
+			cart.add('product_2')
+			version = cart._get_cart_version()
+
+		assert 'test_cart_version' not in stale
+
+		client = app.test_client()
+
+		with client.session_transaction() as sess:
+			sess.update(stale)
+
+		response = client.get('/api/cart', headers={'If-None-Match': etag})
+		assert response.status_code == 200
+		assert response.headers['ETag'] == f'"{version}"'
+		assert set(response.json) == {'seed', 'product_1', 'product_2'}
+
+		assert client.delete('/api/cart', headers={'If-Match': etag}).status_code == 412
+		assert set(store.get(stale['test_cart_id'])['lines']) == {'seed', 'product_1', 'product_2'}
+
+	def test_concurrent_changes_are_not_lost(self, app: Flask):
+		store = SlowMemoryCartStore()
+		cart = FlaskShoppingCart(app, storage=store, lock=StripedCartLock())
+
+		def add():
+			for _ in range(20):
+				with app.test_request_context():
+					session['test_cart_id'] = 'shared'
+					cart.get_cart()
+					cart.add('product_1')
+
+		threads = [threading.Thread(target=add) for _ in range(10)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		assert store.get('shared')['lines'] == {'product_1': {'quantity': 200}}
@@ -0,0 +1,170 @@
+# type: ignore
+
+from decimal import Decimal
+
+import pytest
+from flask import Flask, session
+
+from src.flask_shoppingcart import (FlaskShoppingCart, MemoryReservationLedger,
+                                    OutOfStokError, QuantityValidator,
+                                    Violation)
+
+
+class RacingLedger(MemoryReservationLedger):
+	"""
+	Another cart holds the whole stock of product_3 between the validation and the holds.
+	"""
+
+	def reserve(self, product_id, holder_id, quantity, stock, ttl):
+		if product_id == 'product_3' and holder_id != 'other_cart':
+			super().reserve(product_id, 'other_cart', stock, stock, ttl)
+
+		super().reserve(product_id, holder_id, quantity, stock, ttl)
+
+
+class TestQuantityValidator:
+	def test_mixed_types_normalized(self):
+		result = QuantityValidator(precision=0).validate({'product_1': 2, 'product_2': 3.0, 'product_3': Decimal('4')})
+
+		assert result.ok
+		assert result.quantities == {'product_1': 2, 'product_2': 3, 'product_3': 4}
+		assert all(type(quantity) is Decimal for quantity in result.quantities.values())
+
+	def test_fixed_precision(self):
+		validator = QuantityValidator(precision=2)
+		result = validator.validate({'product_1': 0.1, 'product_2': Decimal('0.125')}, current={'product_1': 1.4})
+
+		assert str(result.quantities['product_1']) == '1.50'
+		assert result.violations == [Violation('product_2', 'precision', Decimal('0.125'))]
+
+	def test_without_precision(self):
+		result = QuantityValidator().validate({'product_1': 0.1, 'product_2': 2}, current={'product_1': 0.2})
+
+		assert result.quantities == {'product_1': Decimal('0.3'), 'product_2': Decimal('2')}
+		assert all(type(quantity) is Decimal for quantity in result.quantities.values())
+
+	def test_current_quantities_are_checked(self):
+		validator = QuantityValidator(precision=0)
+		result = validator.validate(
+			{'product_1': 1, 'product_2': 1, 'product_3': 1},
+			current={'product_1': 0, 'product_2': 'two', 'product_3': 0.5},
+		)
+
+		assert result.quantities == {'product_1': 1}
+		assert result.violations == [
+			Violation('product_2', 'invalid', 'two'),
+			Violation('product_3', 'precision', 0.5),
+		]
+
+	def test_all_violations_returned(self):
+		validator = QuantityValidator(max_quantity=10)
+		stock = {'product_3': 2, 'product_4': Decimal('5.5')}
+
+		result = validator.validate({
+			'product_1': 'two',
+			'product_2': 0,
+			'product_3': 3,
+			'product_4': 5.5,
+			'product_5': 11,
+			'product_6': True,
+		}, stock.get)
+
+		assert result.quantities == {'product_4': 5.5}
+		assert result.violations == [
+			Violation('product_1', 'invalid', 'two'),
+			Violation('product_2', 'not_positive', 0),
+			Violation('product_3', 'out_of_stock', 3, 2),
+			Violation('product_5', 'above_maximum', 11, 10),
+			Violation('product_6', 'invalid', True),
+		]
+
+	def test_totals_are_checked(self):
+		validator = QuantityValidator(allow_negative=True, min_quantity=1)
+		result = validator.validate({'product_1': -1, 'product_2': -2}, current={'product_1': 3, 'product_2': 2})
+
+		assert result.quantities == {'product_1': 2}
+		assert result.violations == [Violation('product_2', 'below_minimum', -2, 1)]
+
+	def test_negative_precision_fail(self):
+		with pytest.raises(ValueError):
+			QuantityValidator(precision=-1)
+
+
+class TestShoppingCartValidation:
+	def test_add_many_success(self, app: Flask, cart: FlaskShoppingCart):
+		with app.test_request_context():
+			cart.add('product_1', 2)
+			result = cart.add_many({'product_1': 1, 'product_2': Decimal('2')}, {'product_1': 5}.get)
+
+			assert result.ok
+			assert cart.get_cart() == {'product_1': {'quantity': 3}, 'product_2': {'quantity': 2}}
+			assert type(cart.get_product('product_2')['quantity']) is int
+
+			snapshot = cart.snapshot()
+			cart.add_many({'product_1': 1}, overwrite_quantity=True)
+			assert cart.get_product('product_1') == {'quantity': 1}
+			assert snapshot['product_1'].quantity == 3
+
+	def test_add_many_changes_nothing_on_violation(self, app: Flask, cart: FlaskShoppingCart):
+		with app.test_request_context():
+			cart.add('product_1', 2)
+			version = session['test_cart_version']
+
+			result = cart.add_many({'product_1': 4, 'product_2': 1, 'product_3': -1}, {'product_1': 5}.get)
+
+			assert [(violation.product_id, violation.code) for violation in result.violations] == [
+				('product_1', 'out_of_stock'),
+				('product_3', 'not_positive'),
+			]
+			assert cart.get_cart() == {'product_1': {'quantity': 2}}
+			assert session['test_cart_version'] == version
+
+	def test_add_many_fetches_stock_once(self, app: Flask):
+		ledger = MemoryReservationLedger()
+		cart = FlaskShoppingCart(app, reservations=ledger)
+		calls = []
+
+		def get_stock(product_id):
+			calls.append(product_id)
+			return {'product_1': 5}.get(product_id)
+
+		with app.test_request_context():
+			assert cart.add_many({'product_1': 2, 'product_2': 7}, get_stock).ok
+
+			assert calls == ['product_1', 'product_2']
+			assert ledger.get_hold('product_1', cart.cart_id) == 2
+			assert ledger.get_hold('product_2', cart.cart_id) == 0
+
+	def test_add_many_changes_nothing_on_refused_hold(self, app: Flask):
+		ledger = RacingLedger()
+		cart = FlaskShoppingCart(app, reservations=ledger)
+		stock = {'product_1': 5, 'product_2': 5, 'product_3': 5}
+
+		with app.test_request_context():
+			cart.add('product_1', 2, current_stock=5)
+			version = session['test_cart_version']
+
+			with pytest.raises(OutOfStokError):
+				cart.add_many({'product_1': 1, 'product_2': 1, 'product_3': 1}, stock.get)
+
+			assert cart.get_cart() == {'product_1': {'quantity': 2}}
+			assert session['test_cart_version'] == version
+			assert ledger.get_hold('product_1', cart.cart_id) == 2
+			assert ledger.get_hold('product_2', cart.cart_id) == 0
+			assert ledger.held('product_2') == 0
+
+	def test_validate_cart_with_reservations(self, app: Flask):
+		ledger = MemoryReservationLedger()
+		cart = FlaskShoppingCart(app, reservations=ledger, validator=QuantityValidator(precision=0))
+		stock = {'product_1': 5, 'product_2': 5}
+
+		with app.test_request_context():
+			assert cart.add_many({'product_1': 3, 'product_2': 1}, stock.get).ok
+			assert ledger.get_hold('product_1', cart.cart_id) == 3
+
+			ledger.reserve('product_2', 'other_cart', 4, 5, 60)
+			stock['product_1'] = 2
+			result = cart.validate_cart(stock.get)
+
+			assert result.quantities == {'product_2': 1}
+			assert result.violations == [Violation('product_1', 'out_of_stock', 3, 2)]